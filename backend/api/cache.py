@@ -0,0 +1,166 @@
+import time
+from functools import wraps
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.response import Response
+
+RECIPES_CACHE_VERSION_KEY = 'recipes:version'
+INGREDIENTS_CACHE_VERSION_KEY = 'ingredients:version'
+TAGS_CACHE_VERSION_KEY = 'tags:version'
+
+# Параметры запроса, по которым различаются закэшированные ответы.
+# Запросы с любыми другими параметрами в кэш не попадают.
+CACHED_QUERY_PARAMS = (
+    'tags', 'author', 'page', 'limit', 'cursor', 'count'
+)
+
+
+def get_cache_version(key):
+    """
+    Текущая версия набора данных, хранящаяся в общем кэше под ключом key.
+
+    Версия входит в ключи зависимых записей (или сверяется с версией
+    локальных индексов), поэтому её смена делает их недействительными.
+    """
+
+    version = cache.get(key)
+    if version is None:
+        # Если ключ был вытеснен из кэша, начинаем с новой версии,
+        # чтобы не совпасть со старыми записями.
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(key):
+    """Смена версии набора данных."""
+
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, time.time_ns(), None)
+
+
+def get_recipes_cache_version():
+    """Текущая версия кэша рецептов."""
+
+    return get_cache_version(RECIPES_CACHE_VERSION_KEY)
+
+
+def invalidate_recipes_cache():
+    """Сброс всех закэшированных ответов по рецептам."""
+
+    bump_cache_version(RECIPES_CACHE_VERSION_KEY)
+
+
+def invalidate_ingredients_cache():
+    """Сброс версии справочника ингредиентов (и локальных индексов)."""
+
+    bump_cache_version(INGREDIENTS_CACHE_VERSION_KEY)
+
+
+def invalidate_tags_cache():
+    """Сброс версии справочника тэгов."""
+
+    bump_cache_version(TAGS_CACHE_VERSION_KEY)
+
+
+def get_user_cache_version_key(user_id):
+    """Ключ версии пользовательских данных (избранное, корзина, подписки)."""
+
+    return f'user:{user_id}:version'
+
+
+def invalidate_user_cache(user_id):
+    """Сброс версии пользовательских данных."""
+
+    bump_cache_version(get_user_cache_version_key(user_id))
+
+
+def get_recipes_cache_key(request, pk=None):
+    """
+    Ключ кэша для анонимного запроса по нормализованной строке запроса.
+    Возвращает None, если запрос кэшировать нельзя.
+    """
+
+    params = request.query_params
+    if any(param not in CACHED_QUERY_PARAMS for param in params):
+        return None
+
+    query = '&'.join(
+        f'{param}={",".join(sorted(params.getlist(param)))}'
+        for param in CACHED_QUERY_PARAMS if param in params
+    )
+    return (
+        f'recipes:{get_recipes_cache_version()}:{request.get_host()}:'
+        f'{pk or "list"}:{query}'
+    )
+
+
+def cache_anonymous_response(view_method):
+    """
+    Декоратор для list/retrieve вьюсета: ответы анонимным пользователям
+    берутся из общего кэша и сохраняются в него.
+    """
+
+    @wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return view_method(self, request, *args, **kwargs)
+
+        cache_key = get_recipes_cache_key(request, kwargs.get('pk'))
+        if cache_key is None:
+            return view_method(self, request, *args, **kwargs)
+
+        data = cache.get(cache_key)
+        if data is not None:
+            return Response(data)
+
+        response = view_method(self, request, *args, **kwargs)
+        if response.status_code == 200:
+            cache.set(
+                cache_key, response.data, settings.RECIPES_CACHE_TIMEOUT
+            )
+        return response
+
+    return wrapper
+
+
+def get_query_hash(request):
+    """Короткий хэш строки запроса для ETag."""
+
+    return md5(request.META.get('QUERY_STRING', '').encode()).hexdigest()[:8]
+
+
+def get_tags_etag(request, *args, **kwargs):
+    """ETag справочника тэгов по его версии."""
+
+    return (
+        f'tags-{get_cache_version(TAGS_CACHE_VERSION_KEY)}-'
+        f'{kwargs.get("pk", "list")}'
+    )
+
+
+def get_ingredients_etag(request, *args, **kwargs):
+    """ETag справочника ингредиентов по его версии и строке запроса."""
+
+    return (
+        f'ingredients-{get_cache_version(INGREDIENTS_CACHE_VERSION_KEY)}-'
+        f'{kwargs.get("pk", "list")}-{get_query_hash(request)}'
+    )
+
+
+def get_recipe_etag(request, pk=None, **kwargs):
+    """
+    ETag рецепта: версия рецептов и, для авторизованного пользователя,
+    версия его избранного, корзины и подписок.
+    """
+
+    user = request.user
+    user_part = 'anonymous'
+    if user.is_authenticated:
+        user_version = get_cache_version(get_user_cache_version_key(user.id))
+        user_part = f'{user.id}.{user_version}'
+    return f'recipe-{pk}-{get_recipes_cache_version()}-{user_part}'
@@ -0,0 +1,155 @@
+from io import BytesIO
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db.transaction import atomic
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from recipes.models import Recipe
+from recipes.storage import lock_stored_file
+
+IMAGE_VARIANT_FORMATS = (
+    ('webp', 'WEBP'),
+    ('jpeg', 'JPEG'),
+)
+IMAGE_VARIANTS_DIR = 'recipes/images/variants'
+
+
+def to_rgb(image):
+    """Перевод в RGB для JPEG; прозрачность заливается белым."""
+
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, 'white')
+        background.paste(image, mask=image.getchannel('A'))
+        return background
+    return image.convert('RGB')
+
+
+def encode_image(image, image_format):
+    """Сжатие изображения в WebP или JPEG."""
+
+    if image_format == 'JPEG':
+        image = to_rgb(image)
+    elif image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA')
+
+    buffer = BytesIO()
+    image.save(
+        buffer,
+        image_format,
+        quality=settings.IMAGE_VARIANTS_QUALITY,
+        optimize=image_format == 'JPEG',
+        progressive=image_format == 'JPEG',
+    )
+    return ContentFile(buffer.getvalue())
+
+
+def get_variant_path(stem, name, extension):
+    """Путь копии: имя исходного файла (хэш содержимого) и размер."""
+
+    return f'{IMAGE_VARIANTS_DIR}/{stem}-{name}.{extension}'
+
+
+def make_image_variants(recipe):
+    """
+    Создание уменьшенных копий изображения рецепта по размерам из
+    IMAGE_VARIANTS (в WebP и JPEG). Возвращает пути копий в хранилище.
+    Копии адресуются по исходному файлу, поэтому уже созданные для
+    такого же изображения другого рецепта используются повторно.
+    """
+
+    stem = Path(recipe.image.name).stem
+    variants = {
+        name: {
+            extension: get_variant_path(stem, name, extension)
+            for extension, _ in IMAGE_VARIANT_FORMATS
+        }
+        for name in settings.IMAGE_VARIANTS
+    }
+    missing = [
+        (name, extension, image_format)
+        for name in variants
+        for extension, image_format in IMAGE_VARIANT_FORMATS
+        if not default_storage.exists(variants[name][extension])
+    ]
+    if not missing:
+        return variants
+
+    with recipe.image.open('rb') as image_file:
+        source = Image.open(image_file)
+        source = ImageOps.exif_transpose(source)
+        source.load()
+
+    resized = {}
+    for name, extension, image_format in missing:
+        if name not in resized:
+            size = settings.IMAGE_VARIANTS[name]
+            resized[name] = source.copy()
+            resized[name].thumbnail((size, size), Image.LANCZOS)
+        variants[name][extension] = default_storage.save(
+            variants[name][extension],
+            encode_image(resized[name], image_format)
+        )
+
+    return variants
+
+
+def release_recipe_image(name):
+    """
+    Удаление изображения и его копий, если на файл больше не ссылается
+    ни один рецепт (счётчик ссылок — число рецептов с этим файлом).
+    Проверка и удаление выполняются под блокировкой имени файла, поэтому
+    параллельная загрузка того же содержимого не получит удалённый файл.
+    """
+
+    if not name:
+        return
+
+    with atomic():
+        lock_stored_file(name)
+        if Recipe.objects.filter(image=name).exists():
+            return
+
+        Recipe._meta.get_field('image').storage.delete(name)
+        stem = Path(name).stem
+        for variant in settings.IMAGE_VARIANTS:
+            for extension, _ in IMAGE_VARIANT_FORMATS:
+                default_storage.delete(
+                    get_variant_path(stem, variant, extension)
+                )
+
+
+def process_next_recipe_image():
+    """
+    Обработка одного рецепта из очереди (рецепты с пустым
+    image_variants). Строка блокируется на время обработки, поэтому
+    несколько воркеров не берут один рецепт. Возвращает рецепт или None,
+    если очередь пуста.
+    """
+
+    with atomic():
+        recipe = Recipe.objects.select_for_update(
+            skip_locked=True
+        ).filter(
+            image_variants={}
+        ).exclude(
+            image__isnull=True
+        ).exclude(
+            image=''
+        ).order_by('id').first()
+
+        if recipe is None:
+            return None
+
+        try:
+            recipe.image_variants = make_image_variants(recipe)
+        except (
+            OSError, UnidentifiedImageError, Image.DecompressionBombError
+        ) as error:
+            recipe.image_variants = {'error': str(error)}
+        recipe.save(update_fields=('image_variants', 'updated_at'))
+
+    return recipe
@@ -0,0 +1,144 @@
+import heapq
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter, defaultdict
+
+from django.conf import settings
+
+from api.cache import INGREDIENTS_CACHE_VERSION_KEY, get_cache_version
+from recipes.models import Ingredients, normalize_name
+
+
+def get_trigrams(word, pad_end=True):
+    """
+    Триграммы слова с отступом в начале (как в pg_trgm).
+    Для вводимого запроса конец слова не дополняется: это префикс.
+    """
+
+    padded = f'  {word} ' if pad_end else f'  {word}'
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class IngredientsIndex:
+    """
+    Компактный индекс справочника ингредиентов в памяти процесса.
+
+    Названия хранятся отсортированными, поэтому поиск по префиксу —
+    это бинарный поиск и последовательное чтение. Для опечаток есть
+    обратный индекс триграмм: кандидаты отбираются по доле общих
+    с запросом триграмм и ранжируются по их сходству (Жаккар).
+    """
+
+    def __init__(self, version, rows):
+        rows = sorted(
+            (normalized_name, pk, name, measurement_unit)
+            for pk, normalized_name, name, measurement_unit in rows
+        )
+        self.version = version
+        self.keys = [row[0] for row in rows]
+        self.ids = array('q', (row[1] for row in rows))
+        self.names = [row[2] for row in rows]
+        self.units = [row[3] for row in rows]
+
+        trigrams = defaultdict(lambda: array('I'))
+        self.trigram_counts = array('H')
+        for position, key in enumerate(self.keys):
+            key_trigrams = set()
+            for word in key.split():
+                key_trigrams |= get_trigrams(word)
+            self.trigram_counts.append(len(key_trigrams))
+            for trigram in key_trigrams:
+                trigrams[trigram].append(position)
+        self.trigrams = dict(trigrams)
+
+    def get_item(self, position):
+        return {
+            'id': self.ids[position],
+            'name': self.names[position],
+            'measurement_unit': self.units[position],
+        }
+
+    def search(self, query, limit):
+        """
+        Сначала названия, начинающиеся с запроса, затем похожие
+        по триграммам. Не более limit результатов.
+        """
+
+        query = normalize_name(query)
+        if not query:
+            return [
+                self.get_item(position)
+                for position in range(min(limit, len(self.keys)))
+            ]
+
+        positions = []
+        start = bisect_left(self.keys, query)
+        for position in range(start, len(self.keys)):
+            if len(positions) >= limit:
+                break
+            if not self.keys[position].startswith(query):
+                break
+            positions.append(position)
+
+        if len(positions) < limit:
+            positions += self.fuzzy_search(
+                query, limit - len(positions), exclude=set(positions)
+            )
+        return [self.get_item(position) for position in positions]
+
+    def fuzzy_search(self, query, limit, exclude):
+        """Поиск с учётом опечаток по доле общих триграмм."""
+
+        query_trigrams = set()
+        for word in query.split():
+            query_trigrams |= get_trigrams(word, pad_end=False)
+
+        scores = Counter()
+        for trigram in query_trigrams:
+            scores.update(self.trigrams.get(trigram, ()))
+
+        threshold = (
+            len(query_trigrams) * settings.INGREDIENTS_SEARCH_SIMILARITY
+        )
+        candidates = (
+            (
+                -score / (
+                    len(query_trigrams) + self.trigram_counts[position]
+                    - score
+                ),
+                position
+            )
+            for position, score in scores.items()
+            if score >= threshold and position not in exclude
+        )
+        return [
+            position for _, position in heapq.nsmallest(limit, candidates)
+        ]
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_ingredients_index():
+    """
+    Индекс ингредиентов текущего процесса. Перестраивается, если
+    версия справочника в общем кэше изменилась.
+    """
+
+    global _index
+
+    version = get_cache_version(INGREDIENTS_CACHE_VERSION_KEY)
+    index = _index
+    if index is None or index.version != version:
+        with _index_lock:
+            if _index is None or _index.version != version:
+                _index = IngredientsIndex(
+                    version,
+                    Ingredients.objects.values_list(
+                        'id', 'normalized_name', 'name', 'measurement_unit'
+                    )
+                )
+            index = _index
+    return index
@@ -1,4 +1,20 @@
-from rest_framework.pagination import PageNumberPagination
+import json
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from binascii import Error as BinasciiError
+from hashlib import md5
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import connections
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (
+    BasePagination, PageNumberPagination, _positive_int
+)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import remove_query_param, replace_query_param
 
 
 class LimitPagination(PageNumberPagination):
@@ -8,3 +24,389 @@ class LimitPagination(PageNumberPagination):
     """
 
     page_size_query_param = 'limit'
+
+
+class ApproximateCountPagination(LimitPagination):
+    """
+    Пагинация по номеру страницы с выбором способа подсчёта объектов
+    через параметр count:
+
+    exact — точный COUNT(*) (по умолчанию);
+    cached — COUNT(*), закэшированный по тексту запроса на
+    PAGINATION_COUNT_CACHE_TIMEOUT секунд;
+    estimate — оценка планировщика PostgreSQL; если она меньше
+    PAGINATION_EXACT_COUNT_THRESHOLD, считается точно;
+    none — без подсчёта, наличие следующей страницы определяется
+    выборкой одного лишнего объекта.
+
+    Если количество неточное, в ответе count_is_approximate = true.
+    """
+
+    count_query_param = 'count'
+    count_mode = 'exact'
+    count_modes = ('exact', 'cached', 'estimate', 'none')
+
+    def get_count_mode(self, request):
+        mode = request.query_params.get(self.count_query_param)
+        return mode if mode in self.count_modes else self.count_mode
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.mode = self.get_count_mode(request)
+        if self.mode == 'exact':
+            return super().paginate_queryset(queryset, request, view)
+
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+
+        try:
+            self.page_number = _positive_int(
+                request.query_params.get(self.page_query_param, 1),
+                strict=True
+            )
+        except ValueError:
+            raise NotFound(self.invalid_page_message)
+
+        offset = (self.page_number - 1) * page_size
+        results = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(results) > page_size
+        results = results[:page_size]
+        if self.page_number > 1 and not results:
+            raise NotFound(self.invalid_page_message)
+
+        self.count, self.count_is_approximate = self.get_count(queryset)
+        if self.count is not None:
+            # Оценка не может быть меньше того, что мы уже увидели.
+            self.count = max(
+                self.count, offset + len(results) + self.has_next
+            )
+
+        self.display_page_controls = False
+        self.request = request
+        return results
+
+    def get_count(self, queryset):
+        """Количество объектов и признак его приблизительности."""
+
+        if self.mode == 'none':
+            return None, True
+
+        queryset = queryset.order_by()
+        if (
+            self.mode == 'estimate'
+            and connections[queryset.db].vendor == 'postgresql'
+        ):
+            estimate = self.get_planner_estimate(queryset)
+            if estimate >= settings.PAGINATION_EXACT_COUNT_THRESHOLD:
+                return estimate, True
+            return queryset.count(), False
+
+        return self.get_cached_count(queryset), True
+
+    @staticmethod
+    def get_planner_estimate(queryset):
+        """Оценка количества строк по плану запроса (EXPLAIN)."""
+
+        sql, params = queryset.query.sql_with_params()
+        with connections[queryset.db].cursor() as cursor:
+            cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+            plan = cursor.fetchone()[0]
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        return int(plan[0]['Plan']['Plan Rows'])
+
+    @staticmethod
+    def get_cached_count(queryset):
+        """COUNT(*) из кэша с ключом по тексту и параметрам запроса."""
+
+        sql, params = queryset.query.sql_with_params()
+        cache_key = 'count:' + md5(f'{sql}{params}'.encode()).hexdigest()
+        count = cache.get(cache_key)
+        if count is None:
+            count = queryset.count()
+            cache.set(
+                cache_key, count, settings.PAGINATION_COUNT_CACHE_TIMEOUT
+            )
+        return count
+
+    def get_paginated_response(self, data):
+        if self.mode == 'exact':
+            return super().get_paginated_response(data)
+        return Response({
+            'count': self.count,
+            'count_is_approximate': self.count_is_approximate,
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_next_link(self):
+        if self.mode == 'exact':
+            return super().get_next_link()
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(
+            url, self.page_query_param, self.page_number + 1
+        )
+
+    def get_previous_link(self):
+        if self.mode == 'exact':
+            return super().get_previous_link()
+        if self.page_number == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(
+            url, self.page_query_param, self.page_number - 1
+        )
+
+
+class KeysetPagination(BasePagination):
+    """
+    Пагинация по ключу (keyset / seek).
+
+    Страница выбирается условием WHERE по значениям полей сортировки
+    последнего показанного объекта, а не через OFFSET, и без COUNT(*),
+    поэтому стоимость запроса не зависит от номера страницы.
+    Сортировка берётся из атрибута вьюсета keyset_ordering и должна
+    однозначно упорядочивать объекты (последним полем идёт id).
+    """
+
+    ordering = ('-id',)
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'limit'
+    max_page_size = None
+    invalid_cursor_message = 'Неверный курсор'
+    display_page_controls = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.page_size = self.get_page_size(request)
+        if not self.page_size:
+            return None
+
+        self.request = request
+        self.ordering = getattr(view, 'keyset_ordering', self.ordering)
+        self.fields = [
+            queryset.model._meta.get_field(name.lstrip('-'))
+            for name in self.ordering
+        ]
+        position, self.reverse = self.decode_cursor(request)
+
+        ordering = self.ordering
+        if self.reverse:
+            ordering = [self.invert(name) for name in ordering]
+        queryset = queryset.order_by(*ordering)
+        if position is not None:
+            queryset = queryset.filter(
+                self.get_seek_filter(ordering, position)
+            )
+
+        results = list(queryset[:self.page_size + 1])
+        has_more = len(results) > self.page_size
+        return self.set_page(results[:self.page_size], has_more, position)
+
+    def set_page(self, results, has_more, position):
+        """Запоминание страницы и наличия соседних страниц."""
+
+        if self.reverse:
+            results.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, position is not None
+        self.page = results
+        return results
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'properties': {
+                'next': {'type': 'string', 'nullable': True},
+                'previous': {'type': 'string', 'nullable': True},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=self.max_page_size
+                )
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.page[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.page[0], reverse=True)
+
+    @staticmethod
+    def invert(name):
+        return name[1:] if name.startswith('-') else f'-{name}'
+
+    @staticmethod
+    def get_seek_filter(ordering, position):
+        """
+        Условие «строго после position» для составного ключа:
+        (a > x) OR (a = x AND b > y) OR ...
+        """
+
+        seek_filter = Q()
+        for index, name in enumerate(ordering):
+            field = name.lstrip('-')
+            lookup = 'lt' if name.startswith('-') else 'gt'
+            condition = Q(**{f'{field}__{lookup}': position[index]})
+            for prev_name, prev_value in zip(ordering[:index], position):
+                condition &= Q(**{prev_name.lstrip('-'): prev_value})
+            seek_filter |= condition
+        return seek_filter
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None, False
+
+        try:
+            cursor = json.loads(urlsafe_b64decode(encoded.encode('ascii')))
+            if len(cursor['p']) != len(self.fields):
+                raise ValueError('Неверная длина позиции курсора')
+            position = [
+                field.to_python(value)
+                for field, value in zip(self.fields, cursor['p'])
+            ]
+            reverse = bool(cursor['r'])
+        except (
+            BinasciiError, DjangoValidationError, KeyError, TypeError,
+            UnicodeError, ValueError
+        ):
+            raise NotFound(self.invalid_cursor_message)
+
+        return position, reverse
+
+    def encode_cursor(self, obj, reverse):
+        position = [field.value_to_string(obj) for field in self.fields]
+        cursor = json.dumps({'p': position, 'r': int(reverse)})
+        encoded = urlsafe_b64encode(cursor.encode('ascii')).decode('ascii')
+        url = self.request.build_absolute_uri()
+        url = remove_query_param(url, 'page')
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+
+class FeedPagination(KeysetPagination):
+    """
+    Keyset-пагинация ленты, собранной из нескольких источников пар
+    (время публикации, id рецепта), по убыванию.
+
+    Страница каждого источника выбирается отдельно по его индексу,
+    затем источники сливаются, и рецепты страницы загружаются
+    одним запросом.
+    """
+
+    ordering = ('-pub_date', '-id')
+
+    def paginate_sources(self, sources, queryset, request, view=None):
+        """
+        sources — пары (queryset, (поле времени, поле id рецепта));
+        queryset — рецепты, из которых загружается страница.
+        """
+
+        self.page_size = self.get_page_size(request)
+        self.request = request
+        self.fields = [
+            queryset.model._meta.get_field(name.lstrip('-'))
+            for name in self.ordering
+        ]
+        position, self.reverse = self.decode_cursor(request)
+
+        keys = []
+        for source, names in sources:
+            ordering = (
+                list(names) if self.reverse
+                else [f'-{name}' for name in names]
+            )
+            source = source.order_by(*ordering)
+            if position is not None:
+                source = source.filter(
+                    self.get_seek_filter(ordering, position)
+                )
+            keys.extend(source.values_list(*names)[:self.page_size + 1])
+        keys.sort(reverse=not self.reverse)
+
+        has_more = len(keys) > self.page_size
+        ids = [recipe_id for _, recipe_id in keys[:self.page_size]]
+        recipes = queryset.in_bulk(ids)
+        results = [recipes[pk] for pk in ids if pk in recipes]
+        return self.set_page(results, has_more, position)
+
+
+class LimitOrKeysetPagination(ApproximateCountPagination):
+    """
+    Пагинация по номеру страницы (как ApproximateCountPagination),
+    а при наличии в запросе параметра cursor — пагинация по ключу
+    без COUNT(*).
+    Первая страница в режиме курсора запрашивается как ?cursor=
+    Во вьюсетах с атрибутом ids_pagination = True (фильтр ids)
+    выборка по списку id (?ids=1,2,3) отдаётся целиком одной страницей
+    без COUNT(*).
+    """
+
+    keyset_pagination_class = KeysetPagination
+    ids_query_param = 'ids'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if getattr(view, 'ids_pagination', False):
+            ids = [
+                value for value in request.query_params.get(
+                    self.ids_query_param, ''
+                ).split(',') if value
+            ]
+            if ids:
+                return self.paginate_ids(queryset, request, len(ids))
+        if self.keyset_pagination_class.cursor_query_param in (
+            request.query_params
+        ):
+            self.keyset = self.keyset_pagination_class()
+            self.display_page_controls = False
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def paginate_ids(self, queryset, request, page_size):
+        """
+        Все рецепты из списка id одним запросом; размер страницы —
+        число id (фильтр ограничивает его RECIPES_BATCH_MAX_SIZE).
+        """
+
+        results = list(queryset[:min(
+            page_size, settings.RECIPES_BATCH_MAX_SIZE
+        )])
+        self.mode = 'ids'
+        self.page_number = 1
+        self.has_next = False
+        self.count, self.count_is_approximate = len(results), False
+        self.display_page_controls = False
+        self.request = request
+        return results
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,146 @@
+"""
+Пул процессов для рендеринга pdf через WeasyPrint.
+
+Процессы API не импортируют WeasyPrint: рендеринг передаётся в пул,
+процессы которого при старте один раз загружают WeasyPrint, шрифты,
+разобранные стили и скомпилированный шаблон списка покупок.
+"""
+
+import logging
+import multiprocessing
+import threading
+import traceback
+
+from django.conf import settings
+from django.template.loader import get_template
+
+from foodgram.settings import TEMPLATES_DIR
+
+
+logger = logging.getLogger(__name__)
+
+
+class PdfRenderError(Exception):
+    """Pdf не удалось сформировать (таймаут или пул не запустился)."""
+
+
+class PdfWorkerInitError(PdfRenderError):
+    """Процесс пула не прогрелся: WeasyPrint, шрифты или шаблон."""
+
+
+# Состояние процесса пула, заполняется в init_worker.
+_worker = {}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def init_worker():
+    """
+    Прогрев процесса пула. Ошибка не выбрасывается: упавший initializer
+    пул перезапускал бы бесконечно, и задания ждали бы до таймаута.
+    Вместо этого ошибка сохраняется и возвращается первым же заданием.
+    """
+
+    try:
+        load_worker()
+    except Exception:
+        _worker.clear()
+        _worker['init_error'] = traceback.format_exc()
+
+
+def load_worker():
+    """Импорт WeasyPrint, шрифты, стили, шаблон и пробный рендер."""
+
+    from weasyprint import CSS, HTML
+    from weasyprint.text.fonts import FontConfiguration
+
+    font_config = FontConfiguration()
+    _worker.update(
+        html_class=HTML,
+        font_config=font_config,
+        stylesheets=[CSS(
+            filename=f'{TEMPLATES_DIR}/shopping_cart_template.css',
+            font_config=font_config,
+        )],
+        template=get_template('shopping_cart_template.html'),
+    )
+    # пробный рендер загружает и кэширует шрифты
+    render_shopping_cart({
+        'username': '', 'ingredients': [], 'current_date': ''
+    })
+
+
+def render_shopping_cart(context):
+    """Рендеринг pdf со списком покупок внутри процесса пула."""
+
+    check_worker()
+    html_string = _worker['template'].render(context)
+    return _worker['html_class'](string=html_string).write_pdf(
+        stylesheets=_worker['stylesheets'],
+        font_config=_worker['font_config'],
+    )
+
+
+def check_worker():
+    """Проверка, что процесс пула прогрелся без ошибок."""
+
+    if 'init_error' in _worker:
+        raise PdfWorkerInitError(_worker['init_error'])
+
+
+def log_worker_init_error(error):
+    logger.error('Пул рендеринга pdf не запустился:\n%s', error)
+
+
+def get_pdf_pool():
+    """Пул рендеринга текущего процесса, создаётся при первом обращении."""
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is None:
+            _pool = multiprocessing.get_context('fork').Pool(
+                processes=settings.PDF_RENDER_POOL_SIZE,
+                initializer=init_worker,
+                maxtasksperchild=settings.PDF_RENDER_MAX_TASKS_PER_CHILD,
+            )
+            # первое задание проверяет прогрев, чтобы ошибка попала
+            # в лог сразу, а не при первом скачивании
+            _pool.apply_async(
+                check_worker, error_callback=log_worker_init_error
+            )
+        return _pool
+
+
+def terminate_pdf_pool():
+    """Остановка пула (зависший рендер не прервать иначе)."""
+
+    global _pool
+
+    with _pool_lock:
+        if _pool is not None:
+            _pool.terminate()
+            _pool = None
+
+
+def render_pdf(context):
+    """
+    Передаёт рендеринг в пул и ждёт результат не дольше
+    PDF_RENDER_TIMEOUT секунд; при превышении пул пересоздаётся.
+    Если процесс пула не прогрелся, ошибка возвращается сразу, а пул
+    пересоздаётся при следующем запросе.
+    """
+
+    result = get_pdf_pool().apply_async(render_shopping_cart, (context,))
+    try:
+        return result.get(timeout=settings.PDF_RENDER_TIMEOUT)
+    except PdfWorkerInitError:
+        # ошибку уже записало в лог проверочное задание пула
+        terminate_pdf_pool()
+        raise PdfRenderError('Сервис формирования pdf недоступен')
+    except multiprocessing.TimeoutError:
+        terminate_pdf_pool()
+        raise PdfRenderError(
+            'Не удалось сформировать pdf за отведённое время'
+        )
@@ -1,5 +1,8 @@
 from collections import Counter
 
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import UploadedFile
 from django.db.transaction import atomic
 from djoser.serializers import (
     UserCreateSerializer as DjoserUserCreateSerializer
@@ -10,9 +13,11 @@ from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 from rest_framework.validators import UniqueTogetherValidator
 
-from foodgram.settings import RECIPES_LIMIT
+from api.uploads import validate_image_file
+from api.utils import change_recipe_cart_totals, get_recipes_limit
 from recipes.models import (
-    Tags, Ingredients, Recipe, RecipeIngredient, Favorites, ShoppingList
+    Tags, Ingredients, Recipe, RecipeIngredient, Favorites, ShoppingList,
+    ShoppingCartExport
 )
 from users.models import User, Follow
 
@@ -61,12 +66,23 @@ class UserSerializer(DjoserUserSerializer):
         )
 
     def get_is_subscribed(self, object):
-        """Подписан ли пользователь на автора."""
+        """
+        Подписан ли пользователь на автора.
+        Берётся из аннотации queryset, а если её нет — из множества
+        id авторов, загружаемого один раз на весь запрос.
+        """
+
+        if hasattr(object, 'is_subscribed'):
+            return object.is_subscribed
 
         user = self.context.get('request').user
 
         if user and user.is_authenticated:
-            return user.follower.filter(author=object).exists()
+            if 'subscribed_ids' not in self.context:
+                self.context['subscribed_ids'] = set(
+                    user.follower.values_list('author_id', flat=True)
+                )
+            return object.id in self.context['subscribed_ids']
         return False
 
 
@@ -113,19 +129,24 @@ class FollowingSerializer(UserSerializer):
             'is_subscribed', 'recipes', 'recipes_count'
         )
 
-    @staticmethod
-    def get_recipes(object):
-        """Получаем рецепты с уменьшенным набором полей."""
+    def get_recipes(self, object):
+        """
+        Получаем рецепты с уменьшенным набором полей.
+        Если рецепты уже загружены во вьюсете, используем их.
+        """
 
-        return ShortRecipeSerializer(
-            object.recipes.all()[:RECIPES_LIMIT], many=True
-        ).data
+        recipes = getattr(object, 'latest_recipes', None)
+        if recipes is None:
+            recipes_limit = get_recipes_limit(self.context.get('request'))
+            recipes = object.recipes.all()[:recipes_limit]
+
+        return ShortRecipeSerializer(recipes, many=True).data
 
     @staticmethod
     def get_recipes_count(object):
-        """Получение количества рецептов."""
+        """Получение количества рецептов из счётчика User.recipes_count."""
 
-        return object.recipes.count()
+        return object.recipes_count
 
 
 class IngredientsSerializer(serializers.ModelSerializer):
@@ -188,6 +209,30 @@ class ShoppingListSerializer(serializers.ModelSerializer):
         )
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для пакетных операций."""
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.RECIPES_BATCH_MAX_SIZE,
+    )
+
+    @staticmethod
+    def validate_ids(ids):
+        """Удаление повторов с сохранением порядка."""
+
+        return list(dict.fromkeys(ids))
+
+
+class ShoppingCartExportSerializer(serializers.ModelSerializer):
+    """Сериализатор статуса выгрузки списка покупок."""
+
+    class Meta:
+        model = ShoppingCartExport
+        fields = ('id', 'status', 'created_at', 'finished_at')
+
+
 class IngredientCreateSerializer(serializers.ModelSerializer):
     """Сериализатор для ингредиента в рецепте."""
 
@@ -199,12 +244,64 @@ class IngredientCreateSerializer(serializers.ModelSerializer):
         fields = ('id', 'amount')
 
 
+class ImageVariantsField(serializers.ReadOnlyField):
+    """
+    Ссылки на уменьшенные копии изображения:
+    {размер: {формат: url}}. Пока копии не готовы — пустой словарь.
+    """
+
+    def to_representation(self, variants):
+        request = self.context.get('request')
+        result = {}
+
+        for name in settings.IMAGE_VARIANTS:
+            formats = variants.get(name)
+            if not formats:
+                continue
+            result[name] = {}
+            for extension, path in formats.items():
+                url = default_storage.url(path)
+                if request is not None:
+                    url = request.build_absolute_uri(url)
+                result[name][extension] = url
+
+        return result
+
+
+class RecipeImageField(Base64ImageField):
+    """
+    Изображение рецепта: base64-строка в JSON или файл из
+    multipart/form-data. Размер и количество пикселей ограничены
+    IMAGE_UPLOAD_MAX_SIZE и IMAGE_UPLOAD_MAX_PIXELS.
+    """
+
+    def to_internal_value(self, data):
+        if isinstance(data, UploadedFile):
+            validate_image_file(data)
+            return serializers.ImageField.to_internal_value(self, data)
+
+        if (
+            isinstance(data, str)
+            and len(data) * 3 // 4 > settings.IMAGE_UPLOAD_MAX_SIZE
+        ):
+            raise ValidationError(
+                f'Размер файла больше {settings.IMAGE_UPLOAD_MAX_SIZE} байт'
+            )
+
+        image = super().to_internal_value(data)
+        if image is not None:
+            validate_image_file(image)
+        return image
+
+
 class ShortRecipeSerializer(serializers.ModelSerializer):
     """Уменьшенный набор полей модели Recipe для подписок."""
 
+    image_variants = ImageVariantsField()
+
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'image_variants', 'cooking_time')
 
 
 class RecipesReadSerializer(serializers.ModelSerializer):
@@ -217,6 +314,7 @@ class RecipesReadSerializer(serializers.ModelSerializer):
     )
     tags = TagsSerializer(many=True, read_only=True)
     image = Base64ImageField()
+    image_variants = ImageVariantsField()
     is_in_shopping_cart = serializers.BooleanField(
         read_only=True, default=False
     )
@@ -229,7 +327,8 @@ class RecipesReadSerializer(serializers.ModelSerializer):
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'is_favorited',
-            'is_in_shopping_cart', 'name', 'image', 'text', 'cooking_time'
+            'is_in_shopping_cart', 'name', 'image', 'image_variants', 'text',
+            'cooking_time'
         )
 
 
@@ -238,7 +337,7 @@ class RecipesWriteSerializer(serializers.ModelSerializer):
 
     author = UserSerializer(read_only=True)
     ingredients = IngredientCreateSerializer(many=True)
-    image = Base64ImageField()
+    image = RecipeImageField()
 
     class Meta:
         model = Recipe
@@ -309,23 +408,56 @@ class RecipesWriteSerializer(serializers.ModelSerializer):
 
     @staticmethod
     def add_ingredients(ingredients, recipe):
-        """Добавление ингредиентов."""
-
-        recipe.ingredients.clear()
-
-        ingredient_ids = [item['id'] for item in ingredients]
-        db_ingredients = Ingredients.objects.in_bulk(ingredient_ids)
+        """
+        Добавление ингредиентов.
+        Новый состав сравнивается с имеющимися строками: вставляются,
+        изменяются и удаляются только отличающиеся. Разница с прежним
+        составом переносится в итоги списков покупок пользователей,
+        у которых рецепт в корзине.
+        """
 
-        recipe_ingredients = [
-            RecipeIngredient(
-                ingredient=db_ingredients[item['id']],
-                recipe=recipe,
-                amount=item['amount']
-            )
-            for item in ingredients
+        existing = {
+            item.ingredient_id: item
+            for item in recipe.recipes_ingredients.all()
+        }
+        old_amounts = {
+            ingredient_id: item.amount
+            for ingredient_id, item in existing.items()
+        }
+        new_amounts = {item['id']: item['amount'] for item in ingredients}
+
+        removed_ids = existing.keys() - new_amounts.keys()
+        if removed_ids:
+            RecipeIngredient.objects.filter(
+                recipe=recipe, ingredient_id__in=removed_ids
+            ).delete()
+
+        changed = []
+        for ingredient_id, item in existing.items():
+            amount = new_amounts.get(ingredient_id)
+            if amount is not None and item.amount != amount:
+                item.amount = amount
+                changed.append(item)
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+
+        added_ids = [
+            ingredient_id for ingredient_id in new_amounts
+            if ingredient_id not in existing
         ]
+        if added_ids:
+            db_ingredients = Ingredients.objects.in_bulk(added_ids)
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    ingredient=db_ingredients[ingredient_id],
+                    recipe=recipe,
+                    amount=new_amounts[ingredient_id]
+                )
+                for ingredient_id in added_ids
+            )
 
-        RecipeIngredient.objects.bulk_create(recipe_ingredients)
+        if old_amounts:
+            change_recipe_cart_totals(recipe.id, old_amounts, new_amounts)
 
     @atomic
     def create(self, validated_data):
@@ -346,22 +478,31 @@ class RecipesWriteSerializer(serializers.ModelSerializer):
 
     @atomic
     def update(self, instance, validated_data):
-        """Изменение рецепта автором."""
+        """
+        Изменение рецепта автором.
+        Тэги перезаписываются только при их изменении, а в базу
+        сохраняются только изменённые поля рецепта.
+        """
 
-        instance.name = validated_data.get('name', instance.name)
-        instance.image = validated_data.get('image', instance.image)
-        instance.text = validated_data.get('text', instance.text)
-        instance.cooking_time = validated_data.get(
-            'cooking_time', instance.cooking_time
-        )
+        update_fields = ['updated_at']
+        for field in ('name', 'image', 'text', 'cooking_time'):
+            value = validated_data.get(field)
+            if value is not None and value != getattr(instance, field):
+                setattr(instance, field, value)
+                update_fields.append(field)
 
         tags_data = validated_data.get('tags')
-        instance.tags.set(tags_data)
+        if tags_data is not None and (
+            {tag.id for tag in tags_data}
+            != {tag.id for tag in instance.tags.all()}
+        ):
+            instance.tags.set(tags_data)
 
         ingredients_data = validated_data.get('ingredients')
-        self.add_ingredients(ingredients_data, instance)
+        if ingredients_data is not None:
+            self.add_ingredients(ingredients_data, instance)
 
-        instance.save()
+        instance.save(update_fields=update_fields)
         return instance
 
     def to_representation(self, instance):
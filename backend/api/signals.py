@@ -0,0 +1,227 @@
+from django.db import transaction
+from django.db.models.signals import (
+    m2m_changed, post_delete, post_save, pre_delete, pre_save
+)
+from django.dispatch import receiver
+
+from api.cache import (
+    invalidate_ingredients_cache, invalidate_recipes_cache,
+    invalidate_tags_cache, invalidate_user_cache
+)
+from api.images import release_recipe_image
+from api.utils import (
+    backfill_feed, change_cart_totals, change_counter, change_recipe_counter,
+    fan_out_recipe, remove_from_feed, should_fan_out
+)
+from recipes.models import (
+    Favorites, Ingredients, Recipe, RecipeIngredient, ShoppingList, Tags
+)
+from users.models import Follow, User
+
+
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+@receiver(post_save, sender=RecipeIngredient)
+@receiver(post_delete, sender=RecipeIngredient)
+@receiver(post_save, sender=Tags)
+@receiver(post_delete, sender=Tags)
+@receiver(post_save, sender=Ingredients)
+@receiver(post_delete, sender=Ingredients)
+@receiver(m2m_changed, sender=Recipe.tags.through)
+@receiver(m2m_changed, sender=Recipe.ingredients.through)
+def recipes_changed(**kwargs):
+    """
+    Сброс кэша рецептов при изменении рецептов и связанных данных.
+    Сбрасываем после коммита, чтобы в кэш не попало незафиксированное
+    состояние.
+    """
+
+    transaction.on_commit(invalidate_recipes_cache)
+
+
+# Поля пользователя, которые выводятся в рецептах как данные автора.
+AUTHOR_FIELDS = frozenset(('email', 'username', 'first_name', 'last_name'))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def author_changed(created=False, update_fields=None, **kwargs):
+    """
+    Сброс кэша рецептов при изменении данных автора. Новый пользователь
+    рецептов ещё не имеет, а сохранения только служебных полей
+    (например, last_login при входе) кэш не сбрасывают.
+    """
+
+    if created:
+        return
+    if update_fields is not None and not AUTHOR_FIELDS & set(update_fields):
+        return
+    transaction.on_commit(invalidate_recipes_cache)
+
+
+@receiver(post_save, sender=Ingredients)
+@receiver(post_delete, sender=Ingredients)
+def ingredients_changed(**kwargs):
+    """Смена версии справочника ингредиентов после коммита."""
+
+    transaction.on_commit(invalidate_ingredients_cache)
+
+
+@receiver(post_save, sender=Tags)
+@receiver(post_delete, sender=Tags)
+def tags_changed(**kwargs):
+    """Смена версии справочника тэгов после коммита."""
+
+    transaction.on_commit(invalidate_tags_cache)
+
+
+@receiver(post_save, sender=Favorites)
+@receiver(post_delete, sender=Favorites)
+@receiver(post_save, sender=ShoppingList)
+@receiver(post_delete, sender=ShoppingList)
+def user_recipes_changed(instance, **kwargs):
+    """Смена версии данных пользователя при изменении избранного/корзины."""
+
+    transaction.on_commit(lambda: invalidate_user_cache(instance.user_id))
+
+
+@receiver(post_save, sender=ShoppingList)
+def shopping_list_added(instance, created, **kwargs):
+    """Добавление ингредиентов рецепта в итоги списка покупок."""
+
+    if created:
+        change_cart_totals(instance.user_id, (instance.recipe_id,))
+
+
+@receiver(pre_delete, sender=ShoppingList)
+def shopping_list_removed(instance, **kwargs):
+    """
+    Вычитание ингредиентов рецепта из итогов списка покупок.
+    pre_delete, а не post_delete: при каскадном удалении рецепта
+    его ингредиенты к post_delete могут быть уже удалены.
+    """
+
+    change_cart_totals(
+        instance.user_id, (instance.recipe_id,), sign=-1
+    )
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_image_replaced(instance, **kwargs):
+    """
+    При замене изображения старый файл освобождается после коммита:
+    удаляется, если на него больше не ссылаются другие рецепты.
+    """
+
+    if instance.pk is None or (instance.image and instance.image._committed):
+        return
+
+    old_name = Recipe.objects.filter(
+        pk=instance.pk
+    ).values_list('image', flat=True).first()
+    if old_name:
+        transaction.on_commit(lambda: release_recipe_image(old_name))
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_image_deleted(instance, **kwargs):
+    """Освобождение изображения удалённого рецепта после коммита."""
+
+    name = instance.image.name
+    transaction.on_commit(lambda: release_recipe_image(name))
+
+
+@receiver(pre_save, sender=Recipe)
+def recipe_fan_out_decided(instance, **kwargs):
+    """Выбор способа доставки нового рецепта в ленты подписчиков."""
+
+    if instance._state.adding:
+        instance.fanned_out = should_fan_out(instance.author_id)
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_published(instance, created, **kwargs):
+    """Рассылка нового рецепта по лентам подписчиков автора."""
+
+    if created and instance.fanned_out:
+        fan_out_recipe(instance)
+
+
+@receiver(post_save, sender=Follow)
+def follow_added(instance, created, **kwargs):
+    """Добавление рецептов автора в ленту нового подписчика."""
+
+    if created:
+        backfill_feed(instance.follower_id, instance.author_id)
+
+
+@receiver(post_delete, sender=Follow)
+def follow_removed(instance, **kwargs):
+    """Удаление рецептов автора из ленты бывшего подписчика."""
+
+    remove_from_feed(instance.follower_id, instance.author_id)
+
+
+@receiver(post_save, sender=Follow)
+@receiver(post_delete, sender=Follow)
+def follow_changed(instance, **kwargs):
+    """Смена версии данных подписчика при изменении подписок."""
+
+    transaction.on_commit(
+        lambda: invalidate_user_cache(instance.follower_id)
+    )
+
+
+@receiver(post_save, sender=Favorites)
+@receiver(post_save, sender=ShoppingList)
+def recipe_counter_increased(sender, instance, created, **kwargs):
+    """Увеличение счётчика избранного/списков покупок у рецепта."""
+
+    if created:
+        change_recipe_counter(sender, (instance.recipe_id,), 1)
+
+
+@receiver(post_delete, sender=Favorites)
+@receiver(post_delete, sender=ShoppingList)
+def recipe_counter_decreased(sender, instance, **kwargs):
+    """Уменьшение счётчика избранного/списков покупок у рецепта."""
+
+    change_recipe_counter(sender, (instance.recipe_id,), -1)
+
+
+@receiver(post_save, sender=Recipe)
+def author_recipes_counter_increased(instance, created, **kwargs):
+    """Увеличение счётчика рецептов автора."""
+
+    if created:
+        change_counter(
+            User.objects.filter(pk=instance.author_id), 'recipes_count', 1
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def author_recipes_counter_decreased(instance, **kwargs):
+    """Уменьшение счётчика рецептов автора."""
+
+    change_counter(
+        User.objects.filter(pk=instance.author_id), 'recipes_count', -1
+    )
+
+
+@receiver(post_save, sender=Follow)
+def followers_counter_increased(instance, created, **kwargs):
+    """Увеличение счётчика подписчиков автора."""
+
+    if created:
+        change_counter(
+            User.objects.filter(pk=instance.author_id), 'followers_count', 1
+        )
+
+
+@receiver(post_delete, sender=Follow)
+def followers_counter_decreased(instance, **kwargs):
+    """Уменьшение счётчика подписчиков автора."""
+
+    change_counter(
+        User.objects.filter(pk=instance.author_id), 'followers_count', -1
+    )
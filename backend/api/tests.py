@@ -0,0 +1,432 @@
+import json
+from base64 import urlsafe_b64encode
+
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from api.cache import get_recipes_cache_version
+from api.utils import rebuild_cart_totals
+from recipes.models import (
+    FeedEntry, Ingredients, Recipe, RecipeIngredient, ShoppingCartTotal,
+    ShoppingList, Tags
+)
+from users.models import Follow, User
+
+
+class RebuildCartTotalsTest(TestCase):
+    """Пересчёт итогов списков покупок."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                email=f'user{i}@test.ru', username=f'user{i}',
+                first_name='Имя', last_name='Фамилия', password='pass'
+            )
+            for i in range(3)
+        ]
+        ingredient = Ingredients.objects.create(
+            name='мука', measurement_unit='г'
+        )
+        recipe = Recipe.objects.create(
+            author=cls.users[0], name='Блины', text='Текст', cooking_time=10
+        )
+        RecipeIngredient.objects.create(
+            recipe=recipe, ingredient=ingredient, amount=3
+        )
+        for user in cls.users:
+            ShoppingList.objects.create(user=user, recipe=recipe)
+
+    def get_totals(self):
+        return sorted(
+            ShoppingCartTotal.objects.values_list(
+                'user_id', 'ingredient_id', 'amount'
+            )
+        )
+
+    def test_scoped_rebuild_matches_full_rebuild(self):
+        rebuild_cart_totals()
+        full = self.get_totals()
+        self.assertEqual([amount for *_, amount in full], [3, 3, 3])
+
+        ShoppingCartTotal.objects.update(amount=0)
+        rebuild_cart_totals(user_ids=[user.id for user in self.users])
+        self.assertEqual(self.get_totals(), full)
+
+
+class SubscriptionsQueriesTest(TestCase):
+    """Число запросов списка подписок не зависит от числа рецептов."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.follower = User.objects.create_user(
+            email='follower@test.ru', username='follower',
+            first_name='Имя', last_name='Фамилия', password='pass'
+        )
+        for i in range(3):
+            author = User.objects.create_user(
+                email=f'author{i}@test.ru', username=f'author{i}',
+                first_name='Имя', last_name='Фамилия', password='pass'
+            )
+            Follow.objects.create(follower=cls.follower, author=author)
+            for j in range(3):
+                Recipe.objects.create(
+                    author=author, name=f'Рецепт {j}', text='Текст',
+                    cooking_time=10
+                )
+
+    def count_queries(self, recipes_limit):
+        client = APIClient()
+        client.force_authenticate(self.follower)
+        with CaptureQueriesContext(connection) as context:
+            response = client.get(
+                '/api/users/subscriptions/',
+                {'recipes_limit': recipes_limit}
+            )
+        self.assertEqual(response.status_code, 200)
+        return len(context)
+
+    def test_recipes_loaded_in_one_query(self):
+        self.assertEqual(self.count_queries(1), self.count_queries(3))
+
+
+class RecipesByIdsTest(TestCase):
+    """Выборка рецептов по списку id отдаётся одной страницей."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@test.ru', username='author',
+            first_name='Имя', last_name='Фамилия', password='pass'
+        )
+        cls.recipe_ids = [
+            Recipe.objects.create(
+                author=author, name=f'Рецепт {i}', text='Текст',
+                cooking_time=10
+            ).id
+            for i in range(20)
+        ]
+
+    def test_all_requested_recipes_returned(self):
+        response = APIClient().get(
+            '/api/recipes/', {'ids': ','.join(map(str, self.recipe_ids))}
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            sorted(recipe['id'] for recipe in response.data['results']),
+            sorted(self.recipe_ids)
+        )
+        self.assertIsNone(response.data['next'])
+
+    def test_ids_ignored_by_other_views(self):
+        users = [
+            User.objects.create_user(
+                email=f'user{i}@test.ru', username=f'user{i}',
+                first_name='Имя', last_name='Фамилия', password='pass'
+            )
+            for i in range(3)
+        ]
+        response = APIClient().get('/api/users/', {'ids': users[-1].id})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['count'], User.objects.count())
+        self.assertEqual(len(response.data['results']), 4)
+
+
+class RecipeConditionalGetTest(TestCase):
+    """Условные запросы рецепта после изменения связанных данных."""
+
+    @classmethod
+    def setUpTestData(cls):
+        author = User.objects.create_user(
+            email='author@test.ru', username='author',
+            first_name='Имя', last_name='Фамилия', password='pass'
+        )
+        cls.tag = Tags.objects.create(
+            name='Завтрак', color='#FF8B2B', slug='breakfast'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=author, name='Блины', text='Текст', cooking_time=10
+        )
+        cls.recipe.tags.set((cls.tag,))
+
+    def test_tag_rename_changes_response(self):
+        client = APIClient()
+        url = f'/api/recipes/{self.recipe.id}/'
+        response = client.get(url)
+        self.assertNotIn('Last-Modified', response)
+        etag = response['ETag']
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.tag.name = 'Обед'
+            self.tag.save()
+
+        response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['tags'][0]['name'], 'Обед')
+
+        response = client.get(
+            url, HTTP_IF_MODIFIED_SINCE='Fri, 01 Jan 2100 00:00:00 GMT'
+        )
+        self.assertEqual(response.status_code, 200)
+
+
+class KeysetPaginationTest(TestCase):
+    """Пагинация рецептов по курсору вперёд и назад."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='author@test.ru', username='author',
+            first_name='Имя', last_name='Фамилия', password='pass'
+        )
+        for i in range(7):
+            Recipe.objects.create(
+                author=cls.user, name=f'Рецепт {i}', text='Текст',
+                cooking_time=10
+            )
+        cls.ordered_ids = list(
+            Recipe.objects.order_by('-pub_date', '-id').values_list(
+                'id', flat=True
+            )
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get_page(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.data
+
+    def test_forward_and_back(self):
+        pages = [self.get_page('/api/recipes/', cursor='', limit=3)]
+        while pages[-1]['next']:
+            pages.append(self.get_page(pages[-1]['next']))
+        self.assertIsNone(pages[0]['previous'])
+        self.assertEqual(
+            [len(page['results']) for page in pages], [3, 3, 1]
+        )
+        self.assertEqual(
+            [recipe['id'] for page in pages for recipe in page['results']],
+            self.ordered_ids
+        )
+
+        page = pages[-1]
+        for expected in reversed(pages[:-1]):
+            page = self.get_page(page['previous'])
+            self.assertEqual(page['results'], expected['results'])
+        self.assertIsNone(page['previous'])
+
+    def test_tampered_cursor(self):
+        for position in ([], ['2020-01-01T00:00:00+00:00', '1', '2']):
+            cursor = urlsafe_b64encode(
+                json.dumps({'p': position, 'r': 0}).encode()
+            ).decode()
+            response = self.client.get('/api/recipes/', {'cursor': cursor})
+            self.assertEqual(response.status_code, 404)
+
+        response = self.client.get('/api/recipes/', {'cursor': 'мусор'})
+        self.assertEqual(response.status_code, 404)
+
+
+class AuthorCacheTest(TestCase):
+    """Кэш рецептов для анонимов и изменения данных автора."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author = User.objects.create_user(
+            email='author@test.ru', username='author',
+            first_name='Имя', last_name='Фамилия', password='pass'
+        )
+        cls.recipe = Recipe.objects.create(
+            author=cls.author, name='Блины', text='Текст', cooking_time=10
+        )
+
+    def get_author_name(self):
+        response = APIClient().get(f'/api/recipes/{self.recipe.id}/')
+        self.assertEqual(response.status_code, 200)
+        return response.data['author']['first_name']
+
+    def test_author_rename_invalidates_cache(self):
+        self.assertEqual(self.get_author_name(), 'Имя')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.first_name = 'Новое'
+            self.author.save()
+        self.assertEqual(self.get_author_name(), 'Новое')
+
+    def test_login_keeps_cache(self):
+        version = get_recipes_cache_version()
+        with self.captureOnCommitCallbacks(execute=True):
+            self.author.save(update_fields=('last_login',))
+        self.assertEqual(get_recipes_cache_version(), version)
+
+
+class CartTotalsTest(TestCase):
+    """Итоги списка покупок поддерживаются при изменениях корзины."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user(
+            email='user@test.ru', username='user',
+            first_name='Имя', last_name='Фамилия', password='pass'
+        )
+        cls.flour, cls.eggs, cls.sugar = (
+            Ingredients.objects.create(name=name, measurement_unit=unit)
+            for name, unit in (('мука', 'г'), ('яйца', 'шт'), ('сахар', 'г'))
+        )
+        cls.pancakes = Recipe.objects.create(
+            author=cls.user, name='Блины', text='Текст', cooking_time=10
+        )
+        RecipeIngredient.objects.create(
+            recipe=cls.pancakes, ingredient=cls.flour, amount=100
+        )
+        RecipeIngredient.objects.create(
+            recipe=cls.pancakes, ingredient=cls.eggs, amount=2
+        )
+        cls.bread = Recipe.objects.create(
+            author=cls.user, name='Хлеб', text='Текст', cooking_time=60
+        )
+        RecipeIngredient.objects.create(
+            recipe=cls.bread, ingredient=cls.flour, amount=50
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assert_totals(self, expected):
+        totals = dict(ShoppingCartTotal.objects.filter(
+            user=self.user
+        ).values_list('ingredient_id', 'amount'))
+        self.assertEqual(totals, {
+            ingredient.id: amount for ingredient, amount in expected.items()
+        })
+        rebuild_cart_totals(user_ids=[self.user.id])
+        self.assertEqual(dict(ShoppingCartTotal.objects.filter(
+            user=self.user
+        ).values_list('ingredient_id', 'amount')), totals)
+
+    def add_to_cart(self, recipe):
+        response = self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+        self.assertEqual(response.status_code, 201)
+
+    def test_add_and_remove(self):
+        self.add_to_cart(self.pancakes)
+        self.add_to_cart(self.bread)
+        self.assert_totals({self.flour: 150, self.eggs: 2})
+
+        response = self.client.delete(
+            f'/api/recipes/{self.bread.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 204)
+        self.assert_totals({self.flour: 100, self.eggs: 2})
+
+        response = self.client.delete(
+            f'/api/recipes/{self.bread.id}/shopping_cart/'
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assert_totals({self.flour: 100, self.eggs: 2})
+
+    def test_recipe_edit(self):
+        self.add_to_cart(self.pancakes)
+        self.add_to_cart(self.bread)
+        response = self.client.patch(
+            f'/api/recipes/{self.pancakes.id}/',
+            {'ingredients': [
+                {'id': self.flour.id, 'amount': 200},
+                {'id': self.sugar.id, 'amount': 10},
+            ]},
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assert_totals({self.flour: 250, self.sugar: 10})
+
+    def test_recipe_delete(self):
+        self.add_to_cart(self.pancakes)
+        self.add_to_cart(self.bread)
+        response = self.client.delete(f'/api/recipes/{self.pancakes.id}/')
+        self.assertEqual(response.status_code, 204)
+        self.assert_totals({self.flour: 50})
+
+
+class FeedTest(TestCase):
+    """Лента подписок после публикации рецепта, подписки и отписки."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.author, cls.follower, cls.newcomer = (
+            User.objects.create_user(
+                email=f'{name}@test.ru', username=name,
+                first_name='Имя', last_name='Фамилия', password='pass'
+            )
+            for name in ('author', 'follower', 'newcomer')
+        )
+        Follow.objects.create(follower=cls.follower, author=cls.author)
+
+    def get_feed_ids(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get('/api/recipes/feed/')
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def subscribe(self, user, method):
+        client = APIClient()
+        client.force_authenticate(user)
+        return getattr(client, method)(
+            f'/api/users/{self.author.id}/subscribe/'
+        )
+
+    def publish(self, name):
+        return Recipe.objects.create(
+            author=self.author, name=name, text='Текст', cooking_time=10
+        )
+
+    def test_publish_follow_unfollow(self):
+        first, second = self.publish('Блины'), self.publish('Хлеб')
+        self.assertTrue(first.fanned_out)
+        self.assertEqual(
+            FeedEntry.objects.filter(follower=self.follower).count(), 2
+        )
+        self.assertEqual(
+            self.get_feed_ids(self.follower), [second.id, first.id]
+        )
+        self.assertEqual(self.get_feed_ids(self.newcomer), [])
+
+        self.assertEqual(
+            self.subscribe(self.newcomer, 'post').status_code, 201
+        )
+        self.assertEqual(
+            self.get_feed_ids(self.newcomer), [second.id, first.id]
+        )
+
+        self.assertEqual(
+            self.subscribe(self.newcomer, 'delete').status_code, 204
+        )
+        self.assertFalse(FeedEntry.objects.filter(follower=self.newcomer))
+        self.assertEqual(self.get_feed_ids(self.newcomer), [])
+        self.assertEqual(
+            self.get_feed_ids(self.follower), [second.id, first.id]
+        )
+
+    def test_popular_author_read_from_recipes(self):
+        fanned_out = self.publish('Блины')
+        with override_settings(FEED_FANOUT_MAX_FOLLOWERS=0):
+            pulled = self.publish('Хлеб')
+        self.assertFalse(pulled.fanned_out)
+        self.assertFalse(FeedEntry.objects.filter(recipe=pulled))
+        self.assertEqual(
+            self.get_feed_ids(self.follower), [pulled.id, fanned_out.id]
+        )
+
+        self.assertEqual(
+            self.subscribe(self.newcomer, 'post').status_code, 201
+        )
+        self.assertEqual(
+            self.get_feed_ids(self.newcomer), [pulled.id, fanned_out.id]
+        )
+        self.subscribe(self.newcomer, 'delete')
+        self.assertEqual(self.get_feed_ids(self.newcomer), [])
@@ -0,0 +1,110 @@
+import json
+
+from django.conf import settings
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http.multipartparser import MultiPartParserError
+from django.utils.datastructures import MultiValueDict
+from PIL import Image, UnidentifiedImageError
+from rest_framework.exceptions import ParseError, ValidationError
+from rest_framework.parsers import DataAndFiles, MultiPartParser
+
+ALLOWED_IMAGE_FORMATS = ('JPEG', 'PNG', 'GIF', 'WEBP')
+
+
+class LimitedTemporaryFileUploadHandler(TemporaryFileUploadHandler):
+    """
+    Загрузка файлов потоком сразу во временный файл на диске
+    с ограничением размера IMAGE_UPLOAD_MAX_SIZE.
+    Слишком большой запрос отклоняется по Content-Length до чтения тела,
+    а файл — как только превышен лимит.
+    """
+
+    def handle_raw_input(
+        self, input_data, META, content_length, boundary,  # noqa: N803
+        encoding=None
+    ):
+        if content_length > (
+            settings.IMAGE_UPLOAD_MAX_SIZE
+            + settings.DATA_UPLOAD_MAX_MEMORY_SIZE
+        ):
+            raise MultiPartParserError('Слишком большой запрос')
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.received_size = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received_size += len(raw_data)
+        if self.received_size > settings.IMAGE_UPLOAD_MAX_SIZE:
+            self.file.close()
+            raise MultiPartParserError(
+                f'Размер файла больше {settings.IMAGE_UPLOAD_MAX_SIZE} байт'
+            )
+        return super().receive_data_chunk(raw_data, start)
+
+
+class JSONFormData(dict):
+    """
+    Поля запроса из JSON. DRF добавляет к ним файлы через update,
+    а dict.update для MultiValueDict подставил бы списки вместо файлов.
+    """
+
+    def copy(self):
+        return type(self)(self)
+
+    def update(self, other=(), **kwargs):
+        if isinstance(other, MultiValueDict):
+            other = other.dict()
+        super().update(other, **kwargs)
+
+
+class MultiPartJSONParser(MultiPartParser):
+    """
+    multipart/form-data, в котором поля запроса могут быть переданы
+    JSON-строкой в части data (для вложенных ingredients),
+    а файлы — отдельными частями.
+    """
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        result = super().parse(stream, media_type, parser_context)
+
+        if 'data' not in result.data:
+            return result
+
+        try:
+            data = json.loads(result.data['data'])
+        except ValueError as error:
+            raise ParseError(f'Неверный JSON в поле data - {error}')
+        if not isinstance(data, dict):
+            raise ParseError('Поле data должно быть JSON-объектом')
+
+        return DataAndFiles(JSONFormData(data), result.files)
+
+
+def validate_image_file(file):
+    """
+    Проверка загруженного изображения по заголовку без декодирования:
+    размер файла, формат и количество пикселей.
+    """
+
+    if file.size > settings.IMAGE_UPLOAD_MAX_SIZE:
+        raise ValidationError(
+            f'Размер файла больше {settings.IMAGE_UPLOAD_MAX_SIZE} байт'
+        )
+
+    try:
+        with Image.open(file) as image:
+            image_format = image.format
+            width, height = image.size
+    except (OSError, UnidentifiedImageError, Image.DecompressionBombError):
+        raise ValidationError('Загрузите корректное изображение')
+    finally:
+        file.seek(0)
+
+    if image_format not in ALLOWED_IMAGE_FORMATS:
+        raise ValidationError(f'Формат {image_format} не поддерживается')
+
+    if width * height > settings.IMAGE_UPLOAD_MAX_PIXELS:
+        raise ValidationError(
+            f'Изображение больше {settings.IMAGE_UPLOAD_MAX_PIXELS} пикселей'
+        )
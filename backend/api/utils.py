@@ -1,42 +1,591 @@
-from datetime import datetime
-from io import BytesIO
+import csv
+import json
+import os
+from datetime import datetime, timedelta
+from functools import reduce
+from hashlib import sha256
+from operator import or_
+from pathlib import Path
+from tempfile import NamedTemporaryFile
 
-from django.db.models import Sum
-from django.template.loader import render_to_string
-from weasyprint import HTML
+from django.conf import settings
+from django.db import connection
+from django.db.models import (
+    Count, F, OuterRef, Q, Subquery, Sum, Value, Window
+)
+from django.db.models.functions import Coalesce, Greatest, RowNumber
+from django.db.transaction import atomic, on_commit
+from django.utils import timezone
 
-from foodgram.settings import TEMPLATES_DIR
-from recipes.models import RecipeIngredient
+from api.cache import invalidate_user_cache
+from api.pdf import render_pdf
+from recipes.models import (
+    FeedEntry, Favorites, Recipe, RecipeIngredient, ShoppingCartExport,
+    ShoppingCartTotal, ShoppingList
+)
+from users.models import Follow, User
 
 
-def create_shopping_cart(username, ingredients):
-    """Создание pdf-файла со списком покупок для загрузки."""
-
-    template_path = f'{TEMPLATES_DIR}/shopping_cart_template.html'
+def create_shopping_cart(username, ingredients, current_date=None):
+    """
+    Создание pdf-файла со списком покупок для загрузки.
+    Рендеринг выполняется в пуле процессов api.pdf.
+    """
 
     context = {
         'username': username,
-        'ingredients': ingredients,
-        'current_date': datetime.today().strftime('%d.%m.%Y'),
+        'ingredients': list(ingredients),
+        'current_date': (
+            current_date or datetime.today().strftime('%d.%m.%Y')
+        ),
     }
 
-    html_string = render_to_string(template_path, context)
+    return render_pdf(context)
+
+
+def get_shopping_cart_pdf(username, ingredients):
+    """
+    Открытый на чтение pdf-файл со списком покупок из кэша на диске.
+
+    Имя файла — хэш содержимого списка, имени пользователя и даты,
+    поэтому pdf рендерится заново только при изменении корзины.
+    Кэш ограничен по общему размеру, вытесняются давно не
+    запрашивавшиеся файлы (LRU по времени изменения файла).
+    """
+
+    ingredients = list(ingredients)
+    current_date = datetime.today().strftime('%d.%m.%Y')
+    content = json.dumps(
+        [username, current_date, ingredients],
+        ensure_ascii=False, sort_keys=True, default=str
+    )
+    digest = sha256(content.encode()).hexdigest()
+
+    cache_dir = Path(settings.SHOPPING_CART_CACHE_DIR)
+    path = cache_dir / f'{digest}.pdf'
+    try:
+        os.utime(path)
+        return open(path, 'rb')
+    except FileNotFoundError:
+        pass
+
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    pdf_file_data = create_shopping_cart(username, ingredients, current_date)
+    with NamedTemporaryFile(dir=cache_dir, suffix='.tmp', delete=False) as tmp:
+        tmp.write(pdf_file_data)
+    os.replace(tmp.name, path)
+
+    evict_shopping_cart_cache(
+        cache_dir, settings.SHOPPING_CART_CACHE_MAX_SIZE, keep=path
+    )
+    return open(path, 'rb')
+
+
+def evict_shopping_cart_cache(cache_dir, max_size, keep=None):
+    """
+    Удаление самых старых pdf, пока кэш больше max_size байт.
+    Файл keep (только что созданный) не удаляется.
+    """
+
+    entries = []
+    for entry in os.scandir(cache_dir):
+        if entry.name.endswith('.pdf') and entry.path != str(keep):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total_size = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total_size <= max_size:
+            break
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total_size -= size
+
+
+class Echo:
+    """Псевдобуфер для csv.writer: возвращает записанную строку."""
 
-    pdf_file = BytesIO()
-    HTML(string=html_string).write_pdf(pdf_file)
+    @staticmethod
+    def write(value):
+        return value
 
-    return pdf_file.getvalue()
+
+def stream_shopping_cart_txt(username, ingredients):
+    """Построчная выгрузка списка покупок в текстовом виде."""
+
+    yield f'Список покупок пользователя "{username}":\n\n'
+    for number, ingredient in enumerate(ingredients.iterator(), start=1):
+        yield (
+            f'{number}. {ingredient["ingredient__name"]} - '
+            f'{ingredient["total_amount"]} '
+            f'{ingredient["ingredient__measurement_unit"]}\n'
+        )
+    yield f'\nСписок создан {datetime.today().strftime("%d.%m.%Y")}\n'
+
+
+def stream_shopping_cart_csv(username, ingredients):
+    """Построчная выгрузка списка покупок в csv."""
+
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for ingredient in ingredients.iterator():
+        yield writer.writerow((
+            ingredient['ingredient__name'],
+            ingredient['ingredient__measurement_unit'],
+            ingredient['total_amount'],
+        ))
+
+
+def stream_shopping_cart_json(username, ingredients):
+    """Выгрузка списка покупок в json по одному элементу."""
+
+    yield '['
+    for number, ingredient in enumerate(ingredients.iterator()):
+        yield (',' if number else '') + json.dumps({
+            'name': ingredient['ingredient__name'],
+            'measurement_unit': ingredient['ingredient__measurement_unit'],
+            'amount': ingredient['total_amount'],
+        }, ensure_ascii=False)
+    yield ']'
+
+
+# Потоковые форматы списка покупок: функция, content type, расширение.
+SHOPPING_CART_STREAM_FORMATS = {
+    'txt': (stream_shopping_cart_txt, 'text/plain; charset=utf-8', 'txt'),
+    'csv': (stream_shopping_cart_csv, 'text/csv; charset=utf-8', 'csv'),
+    'json': (
+        stream_shopping_cart_json, 'application/json; charset=utf-8', 'json'
+    ),
+}
 
 
 def get_shopping_cart_ingredients(user):
-    """Запрос для получения ингредиентов для списка покупок."""
+    """
+    Запрос для получения ингредиентов для списка покупок.
+    Читает готовые суммы из ShoppingCartTotal вместо агрегации
+    по всем рецептам корзины.
+    """
 
-    ingredients = RecipeIngredient.objects.filter(
-        recipe__shopping_list__user=user
+    ingredients = ShoppingCartTotal.objects.filter(
+        user=user, amount__gt=0
     ).order_by(
         'ingredient__name'
     ).values(
-        'ingredient__name', 'ingredient__measurement_unit'
-    ).annotate(total_amount=Sum('amount'))
+        'ingredient__name', 'ingredient__measurement_unit',
+        total_amount=F('amount')
+    )
 
     return ingredients
+
+
+UPSERT_CART_TOTALS_SQL = (
+    'INSERT INTO {totals} (user_id, ingredient_id, amount) {select} '
+    'ON CONFLICT (user_id, ingredient_id) '
+    'DO UPDATE SET amount = {totals}.amount + EXCLUDED.amount'
+)
+
+
+def change_cart_totals(user_id, recipe_ids, sign=1):
+    """
+    Прибавление (sign=1) или вычитание (sign=-1) ингредиентов рецептов
+    из итогов списка покупок пользователя одним запросом.
+    """
+
+    select = (
+        f'SELECT %s, ingredient_id, SUM(amount) * %s '
+        f'FROM {RecipeIngredient._meta.db_table} '
+        f'WHERE recipe_id = ANY(%s) GROUP BY ingredient_id'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            UPSERT_CART_TOTALS_SQL.format(
+                totals=ShoppingCartTotal._meta.db_table, select=select
+            ),
+            (user_id, sign, list(recipe_ids))
+        )
+
+    if sign < 0:
+        ShoppingCartTotal.objects.filter(
+            user_id=user_id, amount__lte=0
+        ).delete()
+
+
+def change_recipe_cart_totals(recipe_id, old_amounts, new_amounts):
+    """
+    Применение изменения ингредиентов рецепта к итогам всех
+    пользователей, у которых рецепт в списке покупок.
+    old_amounts и new_amounts — словари {id ингредиента: количество}.
+    """
+
+    deltas = []
+    for ingredient_id in old_amounts.keys() | new_amounts.keys():
+        delta = (
+            new_amounts.get(ingredient_id, 0)
+            - old_amounts.get(ingredient_id, 0)
+        )
+        if delta:
+            deltas.extend((ingredient_id, delta))
+    if not deltas:
+        return
+
+    values = ', '.join(['(%s, %s)'] * (len(deltas) // 2))
+    select = (
+        f'SELECT cart.user_id, delta.ingredient_id, delta.amount '
+        f'FROM {ShoppingList._meta.db_table} cart '
+        f'CROSS JOIN (VALUES {values}) AS delta(ingredient_id, amount) '
+        f'WHERE cart.recipe_id = %s'
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(
+            UPSERT_CART_TOTALS_SQL.format(
+                totals=ShoppingCartTotal._meta.db_table, select=select
+            ),
+            (*deltas, recipe_id)
+        )
+
+    ShoppingCartTotal.objects.filter(
+        user__shopping_list__recipe_id=recipe_id, amount__lte=0
+    ).delete()
+
+
+def bulk_add_user_recipes(model, user_id, recipe_ids):
+    """
+    Добавление рецептов в избранное (Favorites) или список покупок
+    (ShoppingList) одним запросом. Уже добавленные пропускаются;
+    возвращает id действительно добавленных рецептов.
+    """
+
+    if not recipe_ids:
+        return []
+
+    values = ', '.join(['(%s, %s)'] * len(recipe_ids))
+    params = [
+        value for recipe_id in recipe_ids for value in (user_id, recipe_id)
+    ]
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {model._meta.db_table} (user_id, recipe_id) '
+            f'VALUES {values} ON CONFLICT DO NOTHING RETURNING recipe_id',
+            params
+        )
+        added = [row[0] for row in cursor.fetchall()]
+
+    user_recipes_changed(model, user_id, added, sign=1)
+    return added
+
+
+def bulk_remove_user_recipes(model, user_id, recipe_ids=None):
+    """
+    Удаление рецептов из избранного или списка покупок одним запросом;
+    без recipe_ids удаляются все. Возвращает id удалённых рецептов.
+    """
+
+    sql = f'DELETE FROM {model._meta.db_table} WHERE user_id = %s'
+    params = [user_id]
+    if recipe_ids is not None:
+        sql += ' AND recipe_id = ANY(%s)'
+        params.append(list(recipe_ids))
+
+    with connection.cursor() as cursor:
+        cursor.execute(f'{sql} RETURNING recipe_id', params)
+        removed = [row[0] for row in cursor.fetchall()]
+
+    if model is ShoppingList and recipe_ids is None:
+        # Корзина очищена целиком: итоги удаляются без пересчёта.
+        ShoppingCartTotal.objects.filter(user_id=user_id).delete()
+        change_recipe_counter(model, removed, -1)
+        if removed:
+            on_commit(lambda: invalidate_user_cache(user_id))
+        return removed
+
+    user_recipes_changed(model, user_id, removed, sign=-1)
+    return removed
+
+
+def user_recipes_changed(model, user_id, recipe_ids, sign):
+    """
+    То, что для одиночных изменений делают сигналы: итоги списка
+    покупок и смена версии кэша пользователя после коммита.
+    """
+
+    if not recipe_ids:
+        return
+    if model is ShoppingList:
+        change_cart_totals(user_id, recipe_ids, sign)
+    change_recipe_counter(model, recipe_ids, sign)
+    on_commit(lambda: invalidate_user_cache(user_id))
+
+
+RECIPE_COUNTERS = {
+    Favorites: 'favorites_count',
+    ShoppingList: 'shopping_carts_count',
+}
+
+
+def change_counter(queryset, field, delta):
+    """
+    Атомарное изменение счётчика в базе через F() без чтения строк.
+    Значение не опускается ниже нуля.
+    """
+
+    queryset.update(**{field: Greatest(F(field) + delta, Value(0))})
+
+
+def change_recipe_counter(model, recipe_ids, delta):
+    """Изменение счётчика избранного или списков покупок у рецептов."""
+
+    if recipe_ids:
+        change_counter(
+            Recipe.objects.filter(id__in=recipe_ids),
+            RECIPE_COUNTERS[model], delta
+        )
+
+
+def count_related(model, field):
+    """Подзапрос: количество строк model, ссылающихся на объект по field."""
+
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+def reconcile_counters(model, counters, chunk_size=1000):
+    """
+    Исправление расхождений счётчиков model с фактическим числом
+    связанных строк. Строки обрабатываются порциями по chunk_size
+    по возрастанию id, каждая порция в своей транзакции.
+    counters — {поле счётчика: (модель связи, поле внешнего ключа)}.
+    Возвращает количество исправленных строк.
+    """
+
+    actual = {
+        field: count_related(related_model, related_field)
+        for field, (related_model, related_field) in counters.items()
+    }
+    drift = reduce(or_, (
+        ~Q(**{field: F(f'actual_{field}')}) for field in counters
+    ))
+
+    fixed = 0
+    last_id = 0
+    while True:
+        ids = list(model.objects.filter(
+            pk__gt=last_id
+        ).order_by('pk').values_list('pk', flat=True)[:chunk_size])
+        if not ids:
+            return fixed
+        last_id = ids[-1]
+
+        with atomic():
+            drifted = list(model.objects.filter(pk__in=ids).annotate(**{
+                f'actual_{field}': expression
+                for field, expression in actual.items()
+            }).filter(drift).values_list('pk', flat=True))
+            if drifted:
+                fixed += model.objects.filter(
+                    pk__in=drifted
+                ).update(**actual)
+
+
+def should_fan_out(author_id):
+    """
+    Рассылать ли рецепты автора по лентам при публикации.
+    У авторов с числом подписчиков больше FEED_FANOUT_MAX_FOLLOWERS
+    лента читает рецепты из таблицы рецептов. Число подписчиков
+    берётся из счётчика User.followers_count.
+    """
+
+    followers_count = User.objects.filter(
+        pk=author_id
+    ).values_list('followers_count', flat=True).first()
+    return (followers_count or 0) <= settings.FEED_FANOUT_MAX_FOLLOWERS
+
+
+def fan_out_recipe(recipe):
+    """Запись рецепта в ленты всех подписчиков автора одним запросом."""
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {FeedEntry._meta.db_table} '
+            f'(follower_id, recipe_id, author_id, pub_date) '
+            f'SELECT follower_id, %s, %s, %s '
+            f'FROM {Follow._meta.db_table} WHERE author_id = %s',
+            (recipe.id, recipe.author_id, recipe.pub_date, recipe.author_id)
+        )
+
+
+def backfill_feed(follower_id, author_id):
+    """Добавление в ленту подписчика разосланных рецептов автора."""
+
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'INSERT INTO {FeedEntry._meta.db_table} '
+            f'(follower_id, recipe_id, author_id, pub_date) '
+            f'SELECT %s, id, author_id, pub_date '
+            f'FROM {Recipe._meta.db_table} '
+            f'WHERE author_id = %s AND fanned_out '
+            f'ON CONFLICT DO NOTHING',
+            (follower_id, author_id)
+        )
+
+
+def remove_from_feed(follower_id, author_id):
+    """Удаление рецептов автора из ленты отписавшегося подписчика."""
+
+    FeedEntry.objects.filter(
+        follower_id=follower_id, author_id=author_id
+    ).delete()
+
+
+def rebuild_cart_totals(user_ids=None, batch_size=1000):
+    """
+    Полный пересчёт итогов списков покупок из ShoppingList.
+    Без user_ids пересчитываются все пользователи.
+    """
+
+    totals = ShoppingCartTotal.objects.all()
+    # Условия на корзины задаются одним filter(): второй вызов по
+    # обратной связи добавил бы ещё один JOIN и умножил бы суммы.
+    cart_filter = {'recipe__shopping_list__isnull': False}
+    if user_ids is not None:
+        totals = totals.filter(user_id__in=user_ids)
+        cart_filter['recipe__shopping_list__user_id__in'] = user_ids
+    ingredients = RecipeIngredient.objects.filter(**cart_filter)
+
+    ingredients = ingredients.values(
+        'recipe__shopping_list__user_id', 'ingredient_id'
+    ).annotate(total_amount=Sum('amount')).order_by()
+
+    with atomic():
+        totals.delete()
+        ShoppingCartTotal.objects.bulk_create(
+            (
+                ShoppingCartTotal(
+                    user_id=item['recipe__shopping_list__user_id'],
+                    ingredient_id=item['ingredient_id'],
+                    amount=item['total_amount'],
+                )
+                for item in ingredients.iterator()
+            ),
+            batch_size=batch_size,
+        )
+
+
+def get_recipes_limit(request):
+    """
+    Количество рецептов автора в выдаче подписок из параметра
+    recipes_limit; при отсутствии или ошибке — RECIPES_LIMIT.
+    """
+
+    try:
+        recipes_limit = int(request.query_params['recipes_limit'])
+    except (KeyError, ValueError):
+        return settings.RECIPES_LIMIT
+    return max(recipes_limit, 0)
+
+
+def attach_latest_recipes(authors, recipes_limit):
+    """
+    Загружает не более recipes_limit последних рецептов для каждого
+    автора одним запросом с оконной функцией ROW_NUMBER() и сохраняет
+    их в атрибут latest_recipes.
+    """
+
+    authors = list(authors)
+    latest_recipes = {author.id: [] for author in authors}
+
+    if authors and recipes_limit:
+        ranked = Recipe.objects.filter(
+            author_id__in=latest_recipes
+        ).order_by().only(
+            'id', 'name', 'image', 'image_variants', 'cooking_time',
+            'author_id', 'pub_date'
+        ).annotate(
+            recipe_rank=Window(
+                expression=RowNumber(),
+                partition_by=F('author_id'),
+                order_by=(F('pub_date').desc(), F('id').desc()),
+            )
+        )
+        sql, params = ranked.query.sql_with_params()
+        recipes = Recipe.objects.raw(
+            f'SELECT * FROM ({sql}) ranked '
+            f'WHERE ranked.recipe_rank <= %s '
+            f'ORDER BY ranked.recipe_rank',
+            (*params, recipes_limit)
+        )
+        for recipe in recipes:
+            latest_recipes[recipe.author_id].append(recipe)
+
+    for author in authors:
+        author.latest_recipes = latest_recipes[author.id]
+    return authors
+
+
+def claim_shopping_cart_export():
+    """
+    Берёт из очереди самое старое задание на выгрузку и помечает его
+    как обрабатываемое. Благодаря SKIP LOCKED несколько воркеров
+    не получат одно и то же задание.
+    """
+
+    with atomic():
+        export = ShoppingCartExport.objects.select_for_update(
+            skip_locked=True
+        ).filter(
+            status=ShoppingCartExport.PENDING
+        ).order_by('id').first()
+
+        if export is None:
+            return None
+
+        export.status = ShoppingCartExport.PROCESSING
+        export.started_at = timezone.now()
+        export.save(update_fields=('status', 'started_at'))
+
+    return export
+
+
+def render_shopping_cart_export(export):
+    """Формирование pdf для задания на выгрузку."""
+
+    try:
+        ingredients = get_shopping_cart_ingredients(export.user)
+        export.pdf = create_shopping_cart(export.user.username, ingredients)
+        export.status = ShoppingCartExport.DONE
+    except Exception as error:
+        export.status = ShoppingCartExport.FAILED
+        export.error = str(error)
+
+    export.finished_at = timezone.now()
+    export.save(update_fields=('pdf', 'status', 'error', 'finished_at'))
+    return export
+
+
+def cleanup_shopping_cart_exports():
+    """
+    Возвращает в очередь задания, зависшие дольше
+    SHOPPING_CART_EXPORT_TIMEOUT (воркер упал), и удаляет завершённые
+    старше SHOPPING_CART_EXPORT_TTL.
+    """
+
+    now = timezone.now()
+    ShoppingCartExport.objects.filter(
+        status=ShoppingCartExport.PROCESSING,
+        started_at__lt=now - timedelta(
+            seconds=settings.SHOPPING_CART_EXPORT_TIMEOUT
+        ),
+    ).update(status=ShoppingCartExport.PENDING, started_at=None)
+
+    ShoppingCartExport.objects.filter(
+        status__in=(ShoppingCartExport.DONE, ShoppingCartExport.FAILED),
+        finished_at__lt=now - timedelta(
+            seconds=settings.SHOPPING_CART_EXPORT_TTL
+        ),
+    ).delete()
@@ -1,27 +1,49 @@
 from io import BytesIO
 
-from django.db.models import Exists, OuterRef
-from django.http import FileResponse
+from django.conf import settings
+from django.db.models import Exists, OuterRef, Prefetch
+from django.db.transaction import atomic
+from django.http import FileResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet
-from rest_framework import permissions, status, viewsets, filters
+from rest_framework import permissions, status, viewsets
 from rest_framework.decorators import action
+from rest_framework.parsers import FormParser, JSONParser
 from rest_framework.response import Response
+from rest_framework.settings import api_settings
 
-from api.paginators import LimitPagination
+from api.cache import (
+    cache_anonymous_response, get_ingredients_etag, get_recipe_etag,
+    get_tags_etag
+)
+from api.ingredients_index import get_ingredients_index
+from api.paginators import FeedPagination, LimitOrKeysetPagination
+from api.pdf import PdfRenderError
 from api.permissions import IsAdmin, IsAuthor
 from api.serializers import (
     TagsSerializer, IngredientsSerializer, RecipesWriteSerializer,
     AddToFavoritesSerializer,
-    ShortRecipeSerializer, ShoppingListSerializer, RecipesReadSerializer
+    ShortRecipeSerializer, ShoppingListSerializer, RecipesReadSerializer,
+    ShoppingCartExportSerializer, RecipeIdsSerializer
 )
 from api.serializers import (
     UserSerializer, FollowSerializer, FollowingSerializer
 )
-from api.utils import create_shopping_cart, get_shopping_cart_ingredients
+from api.uploads import MultiPartJSONParser
+from api.utils import (
+    SHOPPING_CART_STREAM_FORMATS, attach_latest_recipes,
+    bulk_add_user_recipes, bulk_remove_user_recipes, get_recipes_limit,
+    get_shopping_cart_ingredients, get_shopping_cart_pdf
+)
 from recipes.filters import RecipesFiltering
-from recipes.models import Tags, Ingredients, Recipe, Favorites, ShoppingList
+from recipes.models import (
+    Tags, Ingredients, Recipe, RecipeIngredient, Favorites, ShoppingList,
+    ShoppingCartExport, FeedEntry
+)
 from users.models import User, Follow
 
 
@@ -30,7 +52,13 @@ class CustomUserViewSet(UserViewSet):
 
     queryset = User.objects.all()
     serializer_class = UserSerializer
-    pagination_class = LimitPagination
+    pagination_class = LimitOrKeysetPagination
+    keyset_ordering = ('id',)
+
+    def get_queryset(self):
+        """Пользователи с аннотацией подписки текущего пользователя."""
+
+        return super().get_queryset().with_is_subscribed(self.request.user)
 
     @action(
         detail=True, methods=['POST'], url_path='subscribe',
@@ -78,8 +106,12 @@ class CustomUserViewSet(UserViewSet):
         """Возвращает авторов, на которых подписан пользователь."""
 
         user = request.user
-        queryset = User.objects.filter(author__follower=user)
-        pages = self.paginate_queryset(queryset)
+        queryset = User.objects.filter(
+            author__follower=user
+        ).with_is_subscribed(user).order_by('id')
+        pages = attach_latest_recipes(
+            self.paginate_queryset(queryset), get_recipes_limit(request)
+        )
         serializer = FollowingSerializer(
             pages, context={'request': request}, many=True
         )
@@ -107,8 +139,33 @@ class IngredientsViewSet(viewsets.ReadOnlyModelViewSet):
     serializer_class = IngredientsSerializer
     pagination_class = None
     permission_classes = (permissions.AllowAny,)
-    filter_backends = (filters.SearchFilter,)
-    search_fields = ('^name',)
+
+    @method_decorator(condition(etag_func=get_ingredients_etag))
+    def retrieve(self, request, *args, **kwargs):
+        """Ингредиент по id с поддержкой If-None-Match."""
+
+        return super().retrieve(request, *args, **kwargs)
+
+    @method_decorator(condition(etag_func=get_ingredients_etag))
+    def list(self, request, *args, **kwargs):
+        """
+        Поиск ингредиентов по названию: по индексу в памяти процесса
+        (по началу названия и с учётом опечаток) или, если
+        INGREDIENTS_SEARCH_BACKEND = 'database', одним запросом к БД
+        (сначала по началу названия, затем по вхождению).
+        Поддерживает If-None-Match.
+        """
+
+        query = request.query_params.get(api_settings.SEARCH_PARAM, '')
+        limit = settings.INGREDIENTS_SEARCH_LIMIT
+
+        if settings.INGREDIENTS_SEARCH_BACKEND == 'database':
+            serializer = self.get_serializer(
+                self.get_queryset().search(query)[:limit], many=True
+            )
+            return Response(serializer.data)
+
+        return Response(get_ingredients_index().search(query, limit))
 
 
 class TagsViewSet(viewsets.ReadOnlyModelViewSet):
@@ -119,6 +176,18 @@ class TagsViewSet(viewsets.ReadOnlyModelViewSet):
     pagination_class = None
     permission_classes = (permissions.AllowAny,)
 
+    @method_decorator(condition(etag_func=get_tags_etag))
+    def list(self, request, *args, **kwargs):
+        """Список тэгов с поддержкой If-None-Match."""
+
+        return super().list(request, *args, **kwargs)
+
+    @method_decorator(condition(etag_func=get_tags_etag))
+    def retrieve(self, request, *args, **kwargs):
+        """Тэг по id с поддержкой If-None-Match."""
+
+        return super().retrieve(request, *args, **kwargs)
+
 
 class BaseRecipeMixin:
     """
@@ -138,10 +207,14 @@ class BaseRecipeMixin:
         recipe = get_object_or_404(Recipe, pk=pk)
 
         if request.method == 'DELETE':
-            del_count, _ = model_class.objects.filter(
-                user=request.user, recipe=recipe
-            ).delete()
-            if del_count:
+            # DELETE ... RETURNING: итоги корзины и счётчики меняются
+            # только для реально удалённой строки, поэтому повторный
+            # параллельный запрос не вычтет их второй раз.
+            with atomic():
+                removed = bulk_remove_user_recipes(
+                    model_class, request.user.id, (recipe.id,)
+                )
+            if removed:
                 return Response(status=status.HTTP_204_NO_CONTENT)
             return Response(status=status.HTTP_404_NOT_FOUND)
 
@@ -155,6 +228,69 @@ class BaseRecipeMixin:
             action_serializer.data, status=status.HTTP_201_CREATED
         )
 
+    @staticmethod
+    def bulk_add_or_remove_to_favorites_or_cart(request, model_class):
+        """
+        Пакетное добавление / удаление рецептов из списка ids
+        в избранное или в корзину покупок одним запросом к базе.
+        Возвращает результат по каждому id.
+        """
+
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['ids']
+
+        with atomic():
+            if request.method == 'DELETE':
+                removed = set(bulk_remove_user_recipes(
+                    model_class, request.user.id, recipe_ids
+                ))
+                results = [
+                    {
+                        'id': recipe_id,
+                        'status': (
+                            'removed' if recipe_id in removed
+                            else 'not_in_list'
+                        ),
+                    }
+                    for recipe_id in recipe_ids
+                ]
+            else:
+                found = set(Recipe.objects.filter(
+                    id__in=recipe_ids
+                ).values_list('id', flat=True))
+                added = set(bulk_add_user_recipes(
+                    model_class, request.user.id,
+                    [recipe_id for recipe_id in recipe_ids
+                     if recipe_id in found]
+                ))
+                results = [
+                    {
+                        'id': recipe_id,
+                        'status': (
+                            'added' if recipe_id in added
+                            else 'exists' if recipe_id in found
+                            else 'not_found'
+                        ),
+                    }
+                    for recipe_id in recipe_ids
+                ]
+
+        return Response({'results': results})
+
+    @staticmethod
+    def clear_favorites_or_cart(request, model_class):
+        """Удаление всех рецептов из избранного или корзины покупок."""
+
+        with atomic():
+            removed = bulk_remove_user_recipes(model_class, request.user.id)
+        return Response({
+            'results': [
+                {'id': recipe_id, 'status': 'removed'}
+                for recipe_id in removed
+            ]
+        })
+
 
 class RecipesViewSet(viewsets.ModelViewSet, BaseRecipeMixin):
     """Вьюсет для создания объектов класса Recipe."""
@@ -163,27 +299,66 @@ class RecipesViewSet(viewsets.ModelViewSet, BaseRecipeMixin):
     permission_classes = ((IsAuthor | IsAdmin),)
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipesFiltering
-    pagination_class = LimitPagination
+    pagination_class = LimitOrKeysetPagination
+    parser_classes = (JSONParser, FormParser, MultiPartJSONParser)
+    keyset_ordering = ('-pub_date', '-id')
+    # фильтр ids применяется, и выборка по id отдаётся одной страницей
+    ids_pagination = True
 
     def get_queryset(self):
         """
         Получение оптимизированного queryset
         с аннотациями и подзапросами.
+
+        Теги, ингредиенты и автор (с признаком подписки) подгружаются
+        отдельными prefetch-запросами, поэтому количество запросов к БД
+        не зависит от размера страницы.
         """
 
-        if self.request.user.is_authenticated:
-            queryset = Recipe.objects.annotate(
+        user = self.request.user
+        queryset = Recipe.objects.prefetch_related(
+            Prefetch('tags', queryset=Tags.objects.all()),
+            Prefetch(
+                'recipes_ingredients',
+                queryset=RecipeIngredient.objects.select_related(
+                    'ingredient'
+                )
+            ),
+            Prefetch('author', queryset=User.objects.with_is_subscribed(user))
+        )
+
+        if user.is_authenticated:
+            queryset = queryset.annotate(
                 is_favorited=Exists(Favorites.objects.filter(
-                    user=self.request.user,
+                    user=user,
                     recipe_id=OuterRef('pk'),
                 )),
                 is_in_shopping_cart=Exists(ShoppingList.objects.filter(
-                    user=self.request.user,
+                    user=user,
                     recipe_id=OuterRef('pk'),
                 ))
-            ).select_related('author')
+            )
+
+        return queryset
 
-            return queryset
+    @cache_anonymous_response
+    def list(self, request, *args, **kwargs):
+        """Список рецептов; анонимам отдаётся из общего кэша."""
+
+        return super().list(request, *args, **kwargs)
+
+    @method_decorator(vary_on_headers('Authorization'))
+    # Только ETag: версия кэша рецептов меняется и при правке тэгов,
+    # ингредиентов и авторов, а updated_at рецепта — нет.
+    @method_decorator(condition(etag_func=get_recipe_etag))
+    @cache_anonymous_response
+    def retrieve(self, request, *args, **kwargs):
+        """
+        Рецепт по id; анонимам отдаётся из общего кэша.
+        Поддерживает условные запросы (If-None-Match).
+        """
+
+        return super().retrieve(request, *args, **kwargs)
 
     @action(
         detail=True, methods=['POST', 'DELETE'], url_path='favorite',
@@ -211,13 +386,97 @@ class RecipesViewSet(viewsets.ModelViewSet, BaseRecipeMixin):
             request, pk, ShoppingList, ShoppingListSerializer
         )
 
+    @action(
+        detail=False, methods=['GET'], url_path='feed', url_name='feed',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def feed(self, request):
+        """
+        Лента рецептов авторов, на которых подписан пользователь.
+        Рецепты обычных авторов берутся из ленты подписчика, рецепты
+        авторов с большим числом подписчиков — из таблицы рецептов.
+        """
+
+        user = request.user
+        sources = (
+            (
+                FeedEntry.objects.filter(follower=user),
+                ('pub_date', 'recipe_id'),
+            ),
+            (
+                Recipe.objects.filter(
+                    fanned_out=False,
+                    author_id__in=Follow.objects.filter(
+                        follower=user
+                    ).values('author_id'),
+                ),
+                ('pub_date', 'id'),
+            ),
+        )
+
+        paginator = FeedPagination()
+        page = paginator.paginate_sources(
+            sources, self.get_queryset(), request, self
+        )
+        serializer = RecipesReadSerializer(
+            page, many=True, context=self.get_serializer_context()
+        )
+        return paginator.get_paginated_response(serializer.data)
+
+    @action(
+        detail=False, methods=['POST', 'DELETE'], url_path='favorite',
+        url_name='favorite_batch',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def manage_favorite_batch(self, request):
+        """Пакетное добавление/удаление рецептов в избранное."""
+
+        return self.bulk_add_or_remove_to_favorites_or_cart(
+            request, Favorites
+        )
+
+    @action(
+        detail=False, methods=['DELETE'], url_path='favorite/clear',
+        url_name='favorite_clear',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def clear_favorite(self, request):
+        """Очистка избранного."""
+
+        return self.clear_favorites_or_cart(request, Favorites)
+
+    @action(
+        detail=False, methods=['POST', 'DELETE'], url_path='shopping_cart',
+        url_name='shopping_cart_batch',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def manage_shopping_cart_batch(self, request):
+        """Пакетное добавление/удаление рецептов в список покупок."""
+
+        return self.bulk_add_or_remove_to_favorites_or_cart(
+            request, ShoppingList
+        )
+
+    @action(
+        detail=False, methods=['DELETE'], url_path='shopping_cart/clear',
+        url_name='shopping_cart_clear',
+        permission_classes=(permissions.IsAuthenticated,)
+    )
+    def clear_shopping_cart(self, request):
+        """Очистка списка покупок."""
+
+        return self.clear_favorites_or_cart(request, ShoppingList)
+
     @action(
         detail=False, methods=['GET'], url_path='download_shopping_cart',
         url_name='download_shopping_cart',
         permission_classes=(permissions.IsAuthenticated,),
     )
     def download_shopping_cart(self, request):
-        """Скачивание списка покупок, если он есть."""
+        """
+        Скачивание списка покупок, если он есть.
+        Параметр format: pdf (по умолчанию) или потоковые txt, csv, json.
+        """
 
         if not request.user.shopping_list.exists():
             return Response({'errors': 'Корзина пуста'},
@@ -225,8 +484,97 @@ class RecipesViewSet(viewsets.ModelViewSet, BaseRecipeMixin):
 
         username = request.user.username
         ingredients = get_shopping_cart_ingredients(request.user)
-        pdf_file_data = create_shopping_cart(username, ingredients)
-        response = FileResponse(BytesIO(pdf_file_data),
+        file_format = request.query_params.get('format', 'pdf')
+
+        if file_format in SHOPPING_CART_STREAM_FORMATS:
+            stream, content_type, extension = (
+                SHOPPING_CART_STREAM_FORMATS[file_format]
+            )
+            response = StreamingHttpResponse(
+                stream(username, ingredients), content_type=content_type
+            )
+            response[
+                'Content-Disposition'
+            ] = f'attachment; filename="{username}_download_list.{extension}"'
+            return response
+
+        if file_format != 'pdf':
+            return Response({'errors': f'Неизвестный формат {file_format}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            pdf_file = get_shopping_cart_pdf(username, ingredients)
+        except PdfRenderError as error:
+            return Response({'errors': str(error)},
+                            status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        response = FileResponse(pdf_file, content_type='application/pdf')
+        response[
+            'Content-Disposition'
+        ] = f'attachment; filename="{username}_download_list.pdf"'
+
+        return response
+
+    @action(
+        detail=False, methods=['POST'], url_path='shopping_cart_exports',
+        url_name='shopping_cart_exports',
+        permission_classes=(permissions.IsAuthenticated,),
+    )
+    def create_shopping_cart_export(self, request):
+        """
+        Постановка в очередь формирования pdf со списком покупок.
+        Если у пользователя уже есть незавершённое задание, возвращается
+        оно.
+        """
+
+        if not request.user.shopping_list.exists():
+            return Response({'errors': 'Корзина пуста'},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        export = request.user.shopping_cart_exports.defer('pdf').filter(
+            status__in=(
+                ShoppingCartExport.PENDING, ShoppingCartExport.PROCESSING
+            )
+        ).first()
+        if export is None:
+            export = ShoppingCartExport.objects.create(user=request.user)
+
+        serializer = ShoppingCartExportSerializer(export)
+        return Response(serializer.data, status=status.HTTP_202_ACCEPTED)
+
+    @action(
+        detail=False, methods=['GET'],
+        url_path=r'shopping_cart_exports/(?P<export_id>\d+)',
+        url_name='shopping_cart_export',
+        permission_classes=(permissions.IsAuthenticated,),
+    )
+    def get_shopping_cart_export(self, request, export_id):
+        """Статус задания на выгрузку списка покупок."""
+
+        export = get_object_or_404(
+            ShoppingCartExport.objects.defer('pdf'),
+            pk=export_id, user=request.user
+        )
+        serializer = ShoppingCartExportSerializer(export)
+        return Response(serializer.data, status=status.HTTP_200_OK)
+
+    @action(
+        detail=False, methods=['GET'],
+        url_path=r'shopping_cart_exports/(?P<export_id>\d+)/download',
+        url_name='shopping_cart_export_download',
+        permission_classes=(permissions.IsAuthenticated,),
+    )
+    def download_shopping_cart_export(self, request, export_id):
+        """Скачивание готового pdf из задания на выгрузку."""
+
+        export = get_object_or_404(
+            ShoppingCartExport, pk=export_id, user=request.user
+        )
+        if export.status != ShoppingCartExport.DONE:
+            return Response({'errors': 'Список покупок ещё не готов'},
+                            status=status.HTTP_409_CONFLICT)
+
+        username = request.user.username
+        response = FileResponse(BytesIO(bytes(export.pdf)),
                                 content_type='application/pdf')
         response[
             'Content-Disposition'
@@ -234,6 +582,16 @@ class RecipesViewSet(viewsets.ModelViewSet, BaseRecipeMixin):
 
         return response
 
+    def perform_content_negotiation(self, request, force=False):
+        """
+        Параметр format у скачивания списка покупок задаёт формат файла,
+        а не рендерер DRF, поэтому неизвестный DRF формат не даёт 404.
+        """
+
+        if self.action == 'download_shopping_cart':
+            force = True
+        return super().perform_content_negotiation(request, force)
+
     def get_serializer_class(self):
         """Выбор сериализатора для чтения рецепта и редактирования."""
 
@@ -81,6 +81,19 @@ DATABASES = {
 }
 
 
+# Кэш общий для backend и воркеров (версии кэша сбрасываются и там, и
+# там), поэтому в docker-compose каталог CACHE_LOCATION — общий том.
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND',
+            'django.core.cache.backends.filebased.FileBasedCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', '/tmp/foodgram_cache'),
+    }
+}
+
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -110,6 +123,14 @@ REST_FRAMEWORK = {
     'SEARCH_PARAM': 'name',
 }
 
+# Пагинация с приблизительным подсчётом (параметр count в запросе).
+PAGINATION_COUNT_CACHE_TIMEOUT = int(
+    os.getenv('PAGINATION_COUNT_CACHE_TIMEOUT', 60)
+)
+PAGINATION_EXACT_COUNT_THRESHOLD = int(
+    os.getenv('PAGINATION_EXACT_COUNT_THRESHOLD', 1000)
+)
+
 DJOSER = {
     'LOGIN_FIELD': 'email',
     'HIDE_USERS': False,
@@ -138,6 +159,76 @@ USE_TZ = True
 
 RECIPES_LIMIT = 3
 
+# Лента подписок: рецепты авторов, у которых подписчиков больше порога,
+# не рассылаются по лентам, а читаются из таблицы рецептов.
+FEED_FANOUT_MAX_FOLLOWERS = int(
+    os.getenv('FEED_FANOUT_MAX_FOLLOWERS', 1000)
+)
+
+# Наибольшее количество id рецептов в одном пакетном запросе.
+RECIPES_BATCH_MAX_SIZE = int(os.getenv('RECIPES_BATCH_MAX_SIZE', 100))
+
+# Время жизни закэшированных ответов по рецептам для анонимов (секунды).
+RECIPES_CACHE_TIMEOUT = int(os.getenv('RECIPES_CACHE_TIMEOUT', 60 * 5))
+
+# Поиск ингредиентов: 'memory' (индекс в процессе) или 'database',
+# максимум результатов и минимальная доля общих с запросом триграмм
+# для нечёткого совпадения.
+INGREDIENTS_SEARCH_BACKEND = os.getenv('INGREDIENTS_SEARCH_BACKEND', 'memory')
+INGREDIENTS_SEARCH_LIMIT = int(os.getenv('INGREDIENTS_SEARCH_LIMIT', 50))
+INGREDIENTS_SEARCH_SIMILARITY = float(
+    os.getenv('INGREDIENTS_SEARCH_SIMILARITY', 0.5)
+)
+
+# Кэш pdf со списками покупок на диске и его максимальный размер (байты).
+SHOPPING_CART_CACHE_DIR = os.getenv(
+    'SHOPPING_CART_CACHE_DIR', '/tmp/foodgram_shopping_carts'
+)
+SHOPPING_CART_CACHE_MAX_SIZE = int(
+    os.getenv('SHOPPING_CART_CACHE_MAX_SIZE', 100 * 1024 * 1024)
+)
+
+# Пул процессов рендеринга pdf: размер, таймаут задания (секунды),
+# число заданий до перезапуска процесса и прогрев при старте WSGI.
+PDF_RENDER_POOL_SIZE = int(os.getenv('PDF_RENDER_POOL_SIZE', 1))
+PDF_RENDER_TIMEOUT = int(os.getenv('PDF_RENDER_TIMEOUT', 30))
+PDF_RENDER_MAX_TASKS_PER_CHILD = int(
+    os.getenv('PDF_RENDER_MAX_TASKS_PER_CHILD', 100)
+)
+PDF_RENDER_POOL_PREWARM = (
+    os.getenv('PDF_RENDER_POOL_PREWARM', 'True') == 'True'
+)
+
+# Очередь выгрузок списков покупок: через сколько секунд задание
+# считается зависшим и сколько хранится готовый результат.
+SHOPPING_CART_EXPORT_TIMEOUT = int(
+    os.getenv('SHOPPING_CART_EXPORT_TIMEOUT', 60 * 5)
+)
+SHOPPING_CART_EXPORT_TTL = int(
+    os.getenv('SHOPPING_CART_EXPORT_TTL', 60 * 60 * 24)
+)
+
+# Загрузка изображений: файлы из multipart/form-data пишутся потоком
+# во временный файл; ограничения размера (байт) и количества пикселей.
+FILE_UPLOAD_HANDLERS = (
+    'api.uploads.LimitedTemporaryFileUploadHandler',
+)
+IMAGE_UPLOAD_MAX_SIZE = int(
+    os.getenv('IMAGE_UPLOAD_MAX_SIZE', 10 * 1024 * 1024)
+)
+IMAGE_UPLOAD_MAX_PIXELS = int(
+    os.getenv('IMAGE_UPLOAD_MAX_PIXELS', 40_000_000)
+)
+
+# Уменьшенные копии изображений рецептов: наибольшая сторона (px)
+# для каждого размера и качество сжатия WebP/JPEG.
+IMAGE_VARIANTS = {
+    'thumb': int(os.getenv('IMAGE_VARIANT_THUMB_SIZE', 150)),
+    'card': int(os.getenv('IMAGE_VARIANT_CARD_SIZE', 600)),
+    'full': int(os.getenv('IMAGE_VARIANT_FULL_SIZE', 1600)),
+}
+IMAGE_VARIANTS_QUALITY = int(os.getenv('IMAGE_VARIANTS_QUALITY', 80))
+
 STATIC_URL = '/static/'
 STATIC_ROOT = BASE_DIR / 'collected_static'
 
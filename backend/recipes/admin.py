@@ -2,11 +2,40 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django_admin_listfilter_dropdown.filters import DropdownFilter
 
+from api.utils import rebuild_cart_totals
+from recipes.admin_utils import (
+    AuthorFilter, EstimatedCountPaginator, InputFilter
+)
 from recipes.models import (
-    Ingredients, Tags, RecipeIngredient, Recipe, Favorites, ShoppingList
+    Ingredients, Tags, RecipeIngredient, Recipe, Favorites, ShoppingList,
+    ShoppingCartExport, ShoppingCartTotal, normalize_name
 )
 
 
+def rebuild_recipe_cart_totals(recipe_ids):
+    """Пересчёт итогов корзин, в которых есть рецепты recipe_ids."""
+
+    rebuild_cart_totals(
+        user_ids=ShoppingList.objects.filter(
+            recipe_id__in=recipe_ids
+        ).values_list('user_id', flat=True)
+    )
+
+
+class IngredientNameFilter(InputFilter):
+    """Поиск по началу названия (индекс text_pattern_ops)."""
+
+    parameter_name = 'name'
+    title = 'названию'
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(
+                normalized_name__startswith=normalize_name(self.value())
+            )
+        return queryset
+
+
 @admin.register(Ingredients)
 class IngredientsAdmin(admin.ModelAdmin):
 
@@ -16,7 +45,7 @@ class IngredientsAdmin(admin.ModelAdmin):
     list_display_links = ('name', 'measurement_unit')
     search_fields = ('name', 'measurement_unit')
     list_filter = (
-        ('name', DropdownFilter),
+        IngredientNameFilter,
         ('measurement_unit', DropdownFilter),
     )
     list_per_page = 50
@@ -39,13 +68,41 @@ class TagsAdmin(admin.ModelAdmin):
 class RecipeIngredientAdmin(admin.ModelAdmin):
 
     list_display = ('id', 'recipe', 'ingredient')
-    search_fields = ('recipe', 'ingredient')
+    list_select_related = ('recipe', 'ingredient')
+    autocomplete_fields = ('recipe', 'ingredient')
+    search_fields = ('recipe__name', 'ingredient__name')
     ordering = ('id',)
     empty_value_display = '-Пусто-'
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        rebuild_recipe_cart_totals((obj.recipe_id,))
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        rebuild_recipe_cart_totals((obj.recipe_id,))
+
+    def delete_queryset(self, request, queryset):
+        recipe_ids = list(queryset.values_list('recipe_id', flat=True))
+        super().delete_queryset(request, queryset)
+        rebuild_recipe_cart_totals(recipe_ids)
+
+
+class UserFilter(InputFilter):
+    parameter_name = 'user'
+    title = 'пользователю'
+    lookup = 'user__username'
+
+
+class RecipeNameFilter(InputFilter):
+    parameter_name = 'recipe'
+    title = 'названию рецепта'
+    lookup = 'recipe__name'
+
 
 class IngredientsInLine(admin.TabularInline):
     model = Recipe.ingredients.through
+    autocomplete_fields = ('ingredient',)
 
 
 @admin.register(Recipe)
@@ -74,7 +131,7 @@ class RecipeAdmin(admin.ModelAdmin):
     show_ingredients.short_description = 'Используемые ингредиенты'
 
     def show_favorite(self, object):
-        return object.favorites.all().count()
+        return object.favorites_count
 
     show_favorite.short_description = 'В избранном'
 
@@ -83,7 +140,11 @@ class RecipeAdmin(admin.ModelAdmin):
         'text', 'cooking_time', 'pub_date', 'show_image', 'show_favorite'
     )
     search_fields = ('author__username', 'name')
-    list_filter = ('author__username', 'name', 'tags')
+    list_filter = (AuthorFilter, 'tags')
+    list_select_related = ('author',)
+    autocomplete_fields = ('author',)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
 
     ordering = ('id',)
     empty_value_display = '-Пусто-'
@@ -91,13 +152,25 @@ class RecipeAdmin(admin.ModelAdmin):
         IngredientsInLine,
     )
 
+    def get_queryset(self, request):
+        return super().get_queryset(request).prefetch_related(
+            'tags', 'ingredients'
+        )
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if change:
+            rebuild_recipe_cart_totals((form.instance.id,))
+
 
 @admin.register(Favorites)
 class FavoritesAdmin(admin.ModelAdmin):
 
     list_display = ('id', 'user', 'recipe')
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
     search_fields = ('user__username', 'recipe__name')
-    list_filter = ('user__username', 'recipe__name')
+    list_filter = (UserFilter, RecipeNameFilter)
     ordering = ('id',)
     empty_value_display = '-Пусто-'
 
@@ -106,7 +179,31 @@ class FavoritesAdmin(admin.ModelAdmin):
 class ShoppingListAdmin(admin.ModelAdmin):
 
     list_display = ('id', 'user', 'recipe')
+    list_select_related = ('user', 'recipe')
+    autocomplete_fields = ('user', 'recipe')
     search_fields = ('user__username', 'recipe__name')
-    list_filter = ('user__username', 'recipe__name',)
+    list_filter = (UserFilter, RecipeNameFilter)
     ordering = ('id',)
     empty_value_display = '-Пусто-'
+
+
+@admin.register(ShoppingCartExport)
+class ShoppingCartExportAdmin(admin.ModelAdmin):
+
+    list_display = ('id', 'user', 'status', 'created_at', 'finished_at')
+    list_filter = ('status',)
+    search_fields = ('user__username',)
+    readonly_fields = ('started_at', 'finished_at', 'error')
+    ordering = ('-id',)
+    empty_value_display = '-Пусто-'
+
+
+@admin.register(ShoppingCartTotal)
+class ShoppingCartTotalAdmin(admin.ModelAdmin):
+
+    list_display = ('id', 'user', 'ingredient', 'amount')
+    list_select_related = ('user', 'ingredient')
+    search_fields = ('user__username',)
+    readonly_fields = ('user', 'ingredient', 'amount')
+    ordering = ('user', 'ingredient')
+    empty_value_display = '-Пусто-'
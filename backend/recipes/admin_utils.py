@@ -0,0 +1,70 @@
+from django.contrib import admin
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+
+# Ниже этого числа строк таблица считается точно.
+ESTIMATED_COUNT_THRESHOLD = 10000
+
+
+class InputFilter(admin.SimpleListFilter):
+    """
+    Фильтр с полем ввода вместо списка значений: варианты не выбираются
+    из таблицы, поэтому страница не строит SELECT DISTINCT по всем
+    строкам. Наследники задают parameter_name, title и lookup —
+    условие, по которому фильтруется введённое значение.
+    """
+
+    template = 'admin/input_filter.html'
+    lookup = None
+
+    def lookups(self, request, model_admin):
+        # Непустой список нужен, чтобы админка показала фильтр.
+        return ((None, None),)
+
+    def queryset(self, request, queryset):
+        if self.value():
+            return queryset.filter(**{self.lookup: self.value()})
+        return queryset
+
+    def choices(self, changelist):
+        yield {
+            'value': self.value() or '',
+            'parameter_name': self.parameter_name,
+            'other_params': {
+                key: value
+                for key, value in changelist.get_filters_params().items()
+                if key != self.parameter_name
+            },
+            'query_string': changelist.get_query_string(
+                remove=(self.parameter_name,)
+            ),
+        }
+
+
+class AuthorFilter(InputFilter):
+    parameter_name = 'author'
+    title = 'автору'
+    lookup = 'author__username'
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Пагинатор списка в админке: для нефильтрованной большой таблицы
+    число строк берётся из статистики PostgreSQL (pg_class.reltuples)
+    вместо COUNT(*) по всей таблице.
+    """
+
+    @cached_property
+    def count(self):
+        query = getattr(self.object_list, 'query', None)
+        if query is not None and not query.where:
+            with connections[self.object_list.db].cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE oid = %s::regclass',
+                    (self.object_list.model._meta.db_table,)
+                )
+                row = cursor.fetchone()
+            if row and row[0] >= ESTIMATED_COUNT_THRESHOLD:
+                return int(row[0])
+        return super().count
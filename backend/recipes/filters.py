@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.contrib.auth.models import AnonymousUser
 from django_filters import rest_framework as filters
 from rest_framework.exceptions import ValidationError
@@ -6,9 +7,18 @@ from recipes.models import Recipe
 from users.models import User
 
 
+class NumberInFilter(filters.BaseInFilter, filters.NumberFilter):
+    """Фильтр по списку чисел через запятую."""
+
+
 class RecipesFiltering(filters.FilterSet):
     """Фильтр для сортировки выдачи по тегам."""
 
+    ids = NumberInFilter(
+        method='get_ids',
+        label='ids',
+    )
+
     tags = filters.AllValuesMultipleFilter(
         field_name='tags__slug',
         label='tags',
@@ -30,7 +40,9 @@ class RecipesFiltering(filters.FilterSet):
 
     class Meta:
         model = Recipe
-        fields = ('tags', 'author', 'is_favorited', 'is_in_shopping_cart')
+        fields = (
+            'ids', 'tags', 'author', 'is_favorited', 'is_in_shopping_cart'
+        )
 
     def is_user_anonimous(self):
         """
@@ -61,3 +73,17 @@ class RecipesFiltering(filters.FilterSet):
         if value:
             return queryset.filter(shopping_list__user=self.request.user)
         return queryset
+
+    def get_ids(self, queryset, name, value):
+        """
+        Выборка рецептов по списку id (?ids=1,2,3) одним запросом.
+        Количество id ограничено RECIPES_BATCH_MAX_SIZE; все найденные
+        рецепты отдаются одной страницей (LimitOrKeysetPagination).
+        """
+
+        if len(value) > settings.RECIPES_BATCH_MAX_SIZE:
+            raise ValidationError(
+                f'Можно запросить не больше '
+                f'{settings.RECIPES_BATCH_MAX_SIZE} рецептов'
+            )
+        return queryset.filter(id__in=value)
@@ -1,8 +1,17 @@
 import csv
+import json
 import sys
 import time
+from io import StringIO
+from itertools import islice
+from pathlib import Path
 
-from foodgram.settings import BASE_DIR
+from django.db import connection, transaction
+
+from api.cache import (
+    invalidate_ingredients_cache, invalidate_recipes_cache,
+    invalidate_tags_cache
+)
 from recipes.management.commands.load_functions import (
     load_ingredients, load_users, load_tags
 )
@@ -10,20 +19,53 @@ from recipes.models import Ingredients, Tags
 from users.models import User
 
 # Если потребуется добавить импорты, то можно
-# добавить сюда название модели и файл для импорта.
-CSV_DATA = {
-    Ingredients: 'ingredients.csv',
-    User: 'users.csv',
-    Tags: 'tags.csv'
+# добавить сюда название модели и имя файла без расширения.
+DATA_FILES = {
+    Ingredients: 'ingredients',
+    User: 'users',
+    Tags: 'tags'
 }
 
-# А сюда прописать функцию обработки импорта.
+# А сюда прописать функцию обработки строки файла,
 LOAD_FUNCTIONS = {
     Ingredients: load_ingredients,
     User: load_users,
     Tags: load_tags
 }
 
+# порядок колонок в csv-файле,
+CSV_FIELDS = {
+    Ingredients: ('name', 'measurement_unit'),
+    User: ('email', 'username', 'first_name', 'last_name', 'role'),
+    Tags: ('name', 'color', 'slug')
+}
+
+# естественный ключ (уникальные поля), по которому запись обновляется,
+NATURAL_KEYS = {
+    Ingredients: ('normalized_name', 'measurement_unit'),
+    User: ('email',),
+    Tags: ('name',)
+}
+
+# поля, которые обновляются у существующей записи,
+UPDATE_FIELDS = {
+    Ingredients: ('name',),
+    User: ('username', 'first_name', 'last_name', 'role'),
+    Tags: ('color', 'slug')
+}
+
+# и кэши, которые нужно сбросить после изменения данных.
+INVALIDATE_FUNCTIONS = {
+    Ingredients: (invalidate_ingredients_cache, invalidate_recipes_cache),
+    Tags: (invalidate_tags_cache, invalidate_recipes_cache)
+}
+
+FORMATS = ('csv', 'jsonl', 'json')
+JSON_CHUNK_SIZE = 64 * 1024
+COPY_ESCAPES = str.maketrans({
+    '\\': '\\\\', '\t': '\\t', '\n': '\\n', '\r': '\\r'
+})
+
 
 def wait_for_confirmation(sec):
     """Ожидание и возможность отмены действия."""
@@ -32,30 +74,255 @@ def wait_for_confirmation(sec):
         sys.stdout.write(str(i) + ' ')
         sys.stdout.flush()
         time.sleep(1)
+    sys.stdout.write('\n')
 
 
-def load_func(self, *args, **options):
-    """Загрузка данных в БД."""
+def find_data_file(data_dir, name, preferred_format):
+    """
+    Поиск файла с данными: сначала в формате preferred_format,
+    затем в остальных поддерживаемых.
+    """
+
+    formats = (preferred_format,) + tuple(
+        file_format for file_format in FORMATS
+        if file_format != preferred_format
+    )
+    for file_format in formats:
+        path = Path(data_dir) / f'{name}.{file_format}'
+        if path.exists():
+            return path, file_format
+
+    raise FileNotFoundError(name)
+
+
+def read_csv(file, model):
+    """Строки csv-файла в виде словарей по колонкам CSV_FIELDS."""
+
+    fields = CSV_FIELDS[model]
+    for row in csv.reader(file):
+        yield dict(zip(fields, row))
+
+
+def read_jsonl(file, model):
+    """Объекты из файла JSON Lines, по одному на строку."""
+
+    for line in file:
+        if line.strip():
+            yield json.loads(line)
+
+
+def read_json(file, model):
+    """
+    Объекты из JSON-массива. Файл читается частями, и в памяти
+    одновременно держится только текущий фрагмент.
+    """
+
+    decoder = json.JSONDecoder()
+    buffer = file.read(JSON_CHUNK_SIZE).lstrip()
+    if not buffer.startswith('['):
+        raise ValueError('Ожидается JSON-массив объектов')
+    buffer = buffer[1:]
+
+    while True:
+        buffer = buffer.lstrip().lstrip(',').lstrip()
+        if buffer.startswith(']'):
+            return
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except json.JSONDecodeError:
+            chunk = file.read(JSON_CHUNK_SIZE)
+            if not chunk:
+                raise
+            buffer += chunk
+            continue
+        yield item
+        buffer = buffer[end:]
+
+
+READERS = {
+    'csv': read_csv,
+    'jsonl': read_jsonl,
+    'json': read_json,
+}
 
-    self.stdout.write(self.style.WARNING(
-        'Перед загрузкой тестовых данных БД будет очищена. '
-        'Чтобы отменить операцию импорта нажмите Ctrl + C'
-    ))
-    wait_for_confirmation(7)
 
-    for model, file_csv in CSV_DATA.items():
-        with open(
-                f'{BASE_DIR}/data/{file_csv}',
-                'r', encoding='utf-8'
-        ) as file:
-            data = csv.reader(file)
+def iter_batches(iterable, batch_size):
+    """Разбиение потока на списки длиной не больше batch_size."""
 
-            if model in LOAD_FUNCTIONS:
-                lst = LOAD_FUNCTIONS[model](data)
+    iterator = iter(iterable)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def get_copy_fields(model):
+    """Все поля таблицы, кроме первичного ключа."""
+
+    return [
+        field for field in model._meta.concrete_fields
+        if not field.primary_key
+    ]
+
+
+def create_staging_table(cursor, model):
+    """
+    Временная таблица сессии для COPY с теми же колонками, что у модели.
+    Строки из неё удаляются при коммите каждой пачки.
+    """
+
+    table = model._meta.db_table
+    columns = ', '.join(field.column for field in get_copy_fields(model))
+    cursor.execute(
+        f'CREATE TEMP TABLE IF NOT EXISTS load_{table} '
+        f'ON COMMIT DELETE ROWS '
+        f'AS SELECT {columns} FROM {table} WITH NO DATA'
+    )
+
+
+def drop_staging_table(cursor, model):
+    cursor.execute(f'DROP TABLE IF EXISTS load_{model._meta.db_table}')
+
+
+def to_copy_value(value):
+    """Значение для COPY в текстовом формате с экранированием."""
+
+    if value is None:
+        return '\\N'
+    return str(value).translate(COPY_ESCAPES)
+
+
+def upsert_batch(cursor, model, objects):
+    """
+    Загрузка пачки через COPY во временную таблицу и
+    INSERT ... ON CONFLICT по естественному ключу. Существующие записи
+    обновляются, только если данные отличаются. Возвращает число
+    добавленных и обновлённых записей.
+    """
+
+    table = model._meta.db_table
+    fields = get_copy_fields(model)
+    columns = ', '.join(field.column for field in fields)
+    key = ', '.join(
+        model._meta.get_field(name).column for name in NATURAL_KEYS[model]
+    )
+    update_columns = [
+        model._meta.get_field(name).column for name in UPDATE_FIELDS[model]
+    ]
+
+    buffer = StringIO()
+    for obj in objects:
+        buffer.write('\t'.join(
+            to_copy_value(
+                field.get_db_prep_save(field.pre_save(obj, True), connection)
+            )
+            for field in fields
+        ) + '\n')
+    buffer.seek(0)
+
+    # copy_expert вызывается у курсора psycopg2 напрямую, поэтому
+    # ошибки БД приводим к исключениям Django явно.
+    with connection.wrap_database_errors:
+        cursor.copy_expert(
+            f'COPY load_{table} ({columns}) FROM STDIN',
+            buffer
+        )
+    update = ', '.join(
+        f'{column} = EXCLUDED.{column}' for column in update_columns
+    )
+    current = ', '.join(f'{table}.{column}' for column in update_columns)
+    excluded = ', '.join(f'EXCLUDED.{column}' for column in update_columns)
+    cursor.execute(
+        f'INSERT INTO {table} ({columns}) '
+        f'SELECT DISTINCT ON ({key}) {columns} FROM load_{table} '
+        f'ORDER BY {key} '
+        f'ON CONFLICT ({key}) DO UPDATE SET {update} '
+        f'WHERE ({current}) IS DISTINCT FROM ({excluded}) '
+        f'RETURNING (xmax = 0)'
+    )
+    # xmax = 0 только у вставленных строк, у обновлённых — id транзакции.
+    inserted = [row[0] for row in cursor.fetchall()]
+    return inserted.count(True), inserted.count(False)
+
+
+def load_file(self, model, path, file_format, batch_size):
+    """
+    Потоковая загрузка файла пачками по batch_size строк. Каждая пачка
+    загружается в отдельной короткой транзакции, поэтому блокировки
+    строк не держатся на всё время импорта, а записи, которых нет в
+    файле, не удаляются.
+    """
+
+    load_function = LOAD_FUNCTIONS[model]
+    totals = dict.fromkeys(
+        ('rows', 'inserted', 'updated', 'skipped'), 0
+    )
+    started = time.monotonic()
+
+    with open(path, 'r', encoding='utf-8') as file:
+        rows = READERS[file_format](file, model)
+        with connection.cursor() as cursor:
+            create_staging_table(cursor, model)
+            try:
+                for batch in iter_batches(rows, batch_size):
+                    objects = [
+                        obj for obj in map(load_function, batch)
+                        if obj is not None
+                    ]
+                    if objects:
+                        with transaction.atomic():
+                            inserted, updated = upsert_batch(
+                                cursor, model, objects
+                            )
+                        totals['inserted'] += inserted
+                        totals['updated'] += updated
+                    totals['rows'] += len(batch)
+                    totals['skipped'] += len(batch) - len(objects)
+
+                    rate = totals['rows'] / max(
+                        time.monotonic() - started, 1e-3
+                    )
+                    self.stdout.write(
+                        f'{path.name}: обработано {totals["rows"]} строк '
+                        f'({rate:.0f} строк/с)'
+                    )
+            finally:
+                drop_staging_table(cursor, model)
+
+    if totals['inserted'] or totals['updated']:
+        for invalidate in INVALIDATE_FUNCTIONS.get(model, ()):
+            invalidate()
+
+    totals['elapsed'] = time.monotonic() - started
+    return totals
+
+
+def load_func(self, *args, **options):
+    """Загрузка данных в БД."""
 
-                # очищаем базу от старых данных перед импортом
-                model.objects.all().delete()
-                # наполняем новыми данными
-                model.objects.bulk_create(lst)
+    if not options.get('no_wait'):
+        self.stdout.write(self.style.WARNING(
+            'Данные будут добавлены в БД, существующие записи обновлены. '
+            'Чтобы отменить операцию импорта нажмите Ctrl + C'
+        ))
+        wait_for_confirmation(7)
 
-                print(f'Файл "{file_csv}" загружен')
+    for model, name in DATA_FILES.items():
+        path, file_format = find_data_file(
+            options['data_dir'], name, options['format']
+        )
+        totals = load_file(
+            self, model, path, file_format, options['batch_size']
+        )
+        unchanged = (
+            totals['rows'] - totals['skipped']
+            - totals['inserted'] - totals['updated']
+        )
+        self.stdout.write(
+            f'Файл "{path.name}" загружен за {totals["elapsed"]:.1f} с: '
+            f'добавлено {totals["inserted"]}, '
+            f'обновлено {totals["updated"]}, '
+            f'без изменений {unchanged}, '
+            f'пропущено {totals["skipped"]}'
+        )
@@ -0,0 +1,58 @@
+from django.core.files import File
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand
+from django.db.transaction import atomic
+
+from api.cache import invalidate_recipes_cache
+from api.images import release_recipe_image
+from recipes.models import Recipe
+
+HASHED_IMAGE_REGEX = r'^recipes/images/[0-9a-f]{2}/[0-9a-f]{64}\.'
+
+
+class Command(BaseCommand):
+    """Перенос изображений рецептов в хранилище с адресацией по хэшу."""
+
+    help = (
+        'Переименование изображений рецептов по хэшу содержимого '
+        'и удаление дубликатов'
+    )
+
+    def handle(self, *args, **options):
+        storage = Recipe._meta.get_field('image').storage
+        recipes = Recipe.objects.exclude(
+            image__regex=HASHED_IMAGE_REGEX
+        ).exclude(
+            image__isnull=True
+        ).exclude(
+            image=''
+        ).only('id', 'image', 'image_variants')
+
+        moved = 0
+        for recipe in recipes.iterator():
+            old_name = recipe.image.name
+            try:
+                # запись файла и ссылка на него — в одной транзакции,
+                # см. ContentHashStorage
+                with atomic(), storage.open(old_name) as image_file:
+                    new_name = storage.save(old_name, File(image_file))
+                    Recipe.objects.filter(pk=recipe.pk).update(
+                        image=new_name, image_variants={}
+                    )
+            except FileNotFoundError:
+                self.stderr.write(
+                    f'Рецепт {recipe.id}: файл {old_name} не найден'
+                )
+                continue
+
+            for formats in recipe.image_variants.values():
+                if isinstance(formats, dict):
+                    for path in formats.values():
+                        default_storage.delete(path)
+            release_recipe_image(old_name)
+            moved += 1
+
+        invalidate_recipes_cache()
+        self.stdout.write(
+            self.style.SUCCESS(f'Перенесено изображений: {moved}')
+        )
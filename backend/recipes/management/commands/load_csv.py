@@ -1,35 +1,69 @@
 from django.core.management.base import BaseCommand, CommandError
-from django.db import IntegrityError
+from django.db import DataError, IntegrityError
 
-from recipes.management.commands._load_cvs_func import load_func
+from foodgram.settings import BASE_DIR
+from recipes.management.commands._load_cvs_func import FORMATS, load_func
 
 
 class Command(BaseCommand):
-    """Наполнение БД тестовыми данными из файлов .csv."""
+    """Наполнение БД тестовыми данными из файлов .csv, .json и .jsonl."""
 
-    help = 'Загрузка тестовых файлов .csv в базу данных'
+    help = 'Загрузка тестовых файлов .csv, .json и .jsonl в базу данных'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--no-wait',
+            action='store_true',
+            help='Начать загрузку сразу, без паузы на отмену'
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Число строк в одной пачке'
+        )
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            default='csv',
+            help='Предпочтительный формат, если для модели есть '
+                 'файлы в нескольких форматах'
+        )
+        parser.add_argument(
+            '--data-dir',
+            default=BASE_DIR / 'data',
+            help='Каталог с файлами данных'
+        )
 
     def handle(self, *args, **options):
+        if options['batch_size'] < 1:
+            raise CommandError('--batch-size должен быть больше нуля')
+
         try:
-            load_func(self)
+            load_func(self, **options)
 
-        except IntegrityError:
+        except IntegrityError as error:
             raise CommandError(
-                'База данных нуждается в очистке перед импортом. '
-                'Удалите базу данных и выполните "python manage.py migrate"'
+                'Данные конфликтуют с уже существующими записями '
+                f'(уникальные поля вне ключа загрузки): {error}'
             )
 
-        except FileNotFoundError:
+        except (DataError, ValueError) as error:
+            raise CommandError(f'Некорректные данные в файле: {error}')
+
+        except FileNotFoundError as error:
             raise CommandError(
-                'Файлы формата .csv в /data не найдены')
+                f'Файл {error} (.csv, .json или .jsonl) '
+                f'в {options["data_dir"]} не найден'
+            )
 
-        except Exception:
+        except Exception as error:
             raise CommandError(
-                'Неожиданная ошибка работы импорта load_csv,'
+                f'Неожиданная ошибка работы импорта load_csv: {error}'
             )
 
         self.stdout.write(
             self.style.SUCCESS(
-                'Все данные из csv-файлов загружены в базу данных'
+                'Все данные из файлов загружены в базу данных'
             )
         )
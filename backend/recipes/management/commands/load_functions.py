@@ -1,46 +1,45 @@
-from recipes.models import Ingredients, User, Tags
+from recipes.models import Ingredients, User, Tags, normalize_name
 
 
-def load_ingredients(data):
+def load_ingredients(row):
     """Функция для загрузки ингредиентов."""
 
-    lst = []
-    for row in data:
-        name, measurement_unit = row
-        ingredients = Ingredients(
-            name=name, measurement_unit=measurement_unit
-        )
-        lst.append(ingredients)
+    name = row.get('name')
+    measurement_unit = row.get('measurement_unit')
+    if not name or not measurement_unit:
+        return None
 
-    return lst
+    return Ingredients(
+        name=name,
+        normalized_name=normalize_name(name),
+        measurement_unit=measurement_unit
+    )
 
 
-def load_users(data):
+def load_users(row):
     """Функция для загрузки пользователей."""
 
-    lst = []
-    for row in data:
-        email, username, first_name, last_name, role = row
-        if username and email:
-            user = User(
-                email=email,
-                username=username,
-                first_name=first_name,
-                last_name=last_name,
-                role=role
-            )
-            lst.append(user)
+    email = row.get('email')
+    username = row.get('username')
+    if not username or not email:
+        return None
 
-    return lst
+    return User(
+        email=email,
+        username=username,
+        first_name=row.get('first_name', ''),
+        last_name=row.get('last_name', ''),
+        role=row.get('role') or User.USER
+    )
 
 
-def load_tags(data):
+def load_tags(row):
     """Функция для загрузки тэгов."""
 
-    lst = []
-    for row in data:
-        name, color, slug = row
-        tags = Tags(name=name, color=color, slug=slug)
-        lst.append(tags)
+    name = row.get('name')
+    color = row.get('color')
+    slug = row.get('slug')
+    if not name or not color or not slug:
+        return None
 
-    return lst
+    return Tags(name=name, color=color, slug=slug)
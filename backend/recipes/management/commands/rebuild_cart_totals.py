@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from api.utils import rebuild_cart_totals
+
+
+class Command(BaseCommand):
+    """Пересчёт итогов списков покупок из ShoppingList."""
+
+    help = 'Пересчёт итогов списков покупок пользователей'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--user',
+            type=int,
+            action='append',
+            dest='user_ids',
+            help='id пользователя (можно указать несколько раз)',
+        )
+
+    def handle(self, *args, **options):
+        rebuild_cart_totals(user_ids=options['user_ids'])
+        self.stdout.write(self.style.SUCCESS('Итоги пересчитаны'))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+
+from api.utils import reconcile_counters
+from recipes.models import Favorites, Recipe, ShoppingList
+from users.models import Follow, User
+
+
+class Command(BaseCommand):
+    """Исправление расхождений денормализованных счётчиков."""
+
+    help = 'Пересчёт счётчиков рецептов и пользователей порциями'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=1000,
+            help='Количество строк в одной транзакции',
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options['chunk_size']
+
+        fixed = reconcile_counters(Recipe, {
+            'favorites_count': (Favorites, 'recipe'),
+            'shopping_carts_count': (ShoppingList, 'recipe'),
+        }, chunk_size)
+        self.stdout.write(f'Исправлено рецептов: {fixed}')
+
+        fixed = reconcile_counters(User, {
+            'recipes_count': (Recipe, 'author'),
+            'followers_count': (Follow, 'author'),
+        }, chunk_size)
+        self.stdout.write(f'Исправлено пользователей: {fixed}')
@@ -0,0 +1,43 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.utils import (
+    claim_shopping_cart_export, cleanup_shopping_cart_exports,
+    render_shopping_cart_export
+)
+
+
+class Command(BaseCommand):
+    """Воркер очереди выгрузок списков покупок в pdf."""
+
+    help = 'Обработка очереди заданий на выгрузку списков покупок'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Обработать текущую очередь и завершиться',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2,
+            help='Пауза между проверками пустой очереди (секунды)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            cleanup_shopping_cart_exports()
+
+            export = claim_shopping_cart_export()
+            while export is not None:
+                export = render_shopping_cart_export(export)
+                self.stdout.write(
+                    f'Выгрузка {export.id}: {export.get_status_display()}'
+                )
+                export = claim_shopping_cart_export()
+
+            if options['once']:
+                break
+            time.sleep(options['interval'])
@@ -0,0 +1,35 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.images import process_next_recipe_image
+
+
+class Command(BaseCommand):
+    """Воркер уменьшенных копий изображений рецептов."""
+
+    help = 'Создание уменьшенных копий изображений рецептов'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once',
+            action='store_true',
+            help='Обработать текущую очередь и завершиться',
+        )
+        parser.add_argument(
+            '--interval',
+            type=float,
+            default=2,
+            help='Пауза между проверками пустой очереди (секунды)',
+        )
+
+    def handle(self, *args, **options):
+        while True:
+            recipe = process_next_recipe_image()
+            while recipe is not None:
+                self.stdout.write(f'Изображение рецепта {recipe.id}')
+                recipe = process_next_recipe_image()
+
+            if options['once']:
+                break
+            time.sleep(options['interval'])
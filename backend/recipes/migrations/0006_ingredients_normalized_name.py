@@ -0,0 +1,58 @@
+from django.db import migrations, models
+
+
+def normalize_name(value):
+    return ' '.join(value.lower().replace('ё', 'е').split())
+
+
+def fill_normalized_name(apps, schema_editor):
+    """
+    Заполнение нормализованного названия и объединение дубликатов:
+    ссылки рецептов переносятся на ингредиент с наименьшим id.
+    """
+
+    Ingredients = apps.get_model('recipes', 'Ingredients')
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+
+    kept = {}
+    for ingredient in Ingredients.objects.order_by('id').iterator():
+        ingredient.normalized_name = normalize_name(ingredient.name)
+        key = (ingredient.normalized_name, ingredient.measurement_unit)
+
+        if key not in kept:
+            kept[key] = ingredient.id
+            ingredient.save(update_fields=('normalized_name',))
+            continue
+
+        kept_id = kept[key]
+        for row in RecipeIngredient.objects.filter(ingredient=ingredient):
+            existing = RecipeIngredient.objects.filter(
+                recipe_id=row.recipe_id, ingredient_id=kept_id
+            ).first()
+            if existing:
+                existing.amount += row.amount
+                existing.save(update_fields=('amount',))
+                row.delete()
+            else:
+                row.ingredient_id = kept_id
+                row.save(update_fields=('ingredient',))
+        ingredient.delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_alter_recipeingredient_amount'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredients',
+            name='normalized_name',
+            field=models.CharField(default='', editable=False, max_length=150, verbose_name='Нормализованное название'),
+            preserve_default=False,
+        ),
+        migrations.RunPython(
+            fill_normalized_name, migrations.RunPython.noop
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0006_ingredients_normalized_name'),
+    ]
+
+    operations = [
+        migrations.AddConstraint(
+            model_name='ingredients',
+            constraint=models.UniqueConstraint(fields=('normalized_name', 'measurement_unit'), name='unique_ingredient_name_unit'),
+        ),
+        migrations.AddIndex(
+            model_name='ingredients',
+            index=models.Index(fields=['normalized_name'], name='ingredient_name_pattern_idx', opclasses=('text_pattern_ops',)),
+        ),
+    ]
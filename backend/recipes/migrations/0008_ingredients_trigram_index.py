@@ -0,0 +1,18 @@
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0007_ingredients_unique_normalized_name'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.AddIndex(
+            model_name='ingredients',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['normalized_name'], name='ingredient_name_trgm_idx', opclasses=('gin_trgm_ops',)),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 3.2.3 on 2026-10-18 20:39
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0009_recipe_updated_at'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartExport',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('pending', 'В очереди'), ('processing', 'Формируется'), ('done', 'Готово'), ('failed', 'Ошибка')], default='pending', max_length=20, verbose_name='Статус')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Время создания')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Время начала обработки')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Время завершения')),
+                ('pdf', models.BinaryField(null=True, verbose_name='Файл pdf')),
+                ('error', models.TextField(blank=True, verbose_name='Ошибка')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_exports', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Выгрузка списка покупок',
+                'verbose_name_plural': 'Выгрузки списков покупок',
+                'ordering': ('-id',),
+            },
+        ),
+        migrations.AddIndex(
+            model_name='shoppingcartexport',
+            index=models.Index(fields=['status', 'id'], name='shopping_cart_export_queue_idx'),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# Generated by Django 3.2.3 on 2026-10-18 20:42
+
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_cart_totals(apps, schema_editor):
+    RecipeIngredient = apps.get_model('recipes', 'RecipeIngredient')
+    ShoppingCartTotal = apps.get_model('recipes', 'ShoppingCartTotal')
+
+    totals = RecipeIngredient.objects.filter(
+        recipe__shopping_list__isnull=False
+    ).values(
+        'recipe__shopping_list__user_id', 'ingredient_id'
+    ).annotate(total_amount=Sum('amount')).order_by()
+
+    ShoppingCartTotal.objects.bulk_create(
+        (
+            ShoppingCartTotal(
+                user_id=item['recipe__shopping_list__user_id'],
+                ingredient_id=item['ingredient_id'],
+                amount=item['total_amount'],
+            )
+            for item in totals.iterator()
+        ),
+        batch_size=1000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0010_shoppingcartexport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingCartTotal',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.IntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_totals', to='recipes.ingredients', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_cart_totals', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Итог списка покупок',
+                'verbose_name_plural': 'Итоги списков покупок',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='shoppingcarttotal',
+            constraint=models.UniqueConstraint(fields=('user', 'ingredient'), name='unique_user_ingredient_cart_total'),
+        ),
+        migrations.RunPython(fill_cart_totals, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 3.2.3 on 2026-10-18 20:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_shoppingcarttotal'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False, help_text='Пути к копиям изображения по размерам и форматам', verbose_name='Уменьшенные копии изображения'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('image_variants', {})), fields=['id'], name='recipe_pending_variants_idx'),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 3.2.3 on 2026-10-18 20:50
+
+from django.db import migrations, models
+import recipes.storage
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(default=None, help_text='Загрузите изображение', null=True, storage=recipes.storage.ContentHashStorage(), upload_to='recipes/images/', verbose_name='Изображение'),
+        ),
+    ]
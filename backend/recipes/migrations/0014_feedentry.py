@@ -0,0 +1,77 @@
+# Generated by Django 3.2.3 on 2026-10-18 20:54
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def fill_feed(apps, schema_editor):
+    FeedEntry = apps.get_model('recipes', 'FeedEntry')
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Follow = apps.get_model('users', 'Follow')
+
+    schema_editor.execute(
+        f'INSERT INTO {FeedEntry._meta.db_table} '
+        f'(follower_id, recipe_id, author_id, pub_date) '
+        f'SELECT follow.follower_id, recipe.id, recipe.author_id, '
+        f'recipe.pub_date '
+        f'FROM {Follow._meta.db_table} follow '
+        f'JOIN {Recipe._meta.db_table} recipe '
+        f'ON recipe.author_id = follow.author_id'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0013_recipe_image_content_hash_storage'),
+        ('users', '0003_alter_user_managers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeedEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pub_date', models.DateTimeField(verbose_name='Время публикации')),
+            ],
+            options={
+                'verbose_name': 'Запись ленты',
+                'verbose_name_plural': 'Записи лент',
+            },
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='fanned_out',
+            field=models.BooleanField(default=True, editable=False, help_text='Нет — рецепт популярного автора, лента читает его из таблицы рецептов', verbose_name='Разослан по лентам подписчиков'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(condition=models.Q(('fanned_out', False)), fields=['-pub_date', '-id'], name='recipe_feed_pull_idx'),
+        ),
+        migrations.AddField(
+            model_name='feedentry',
+            name='author',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Автор'),
+        ),
+        migrations.AddField(
+            model_name='feedentry',
+            name='follower',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to=settings.AUTH_USER_MODEL, verbose_name='Подписчик'),
+        ),
+        migrations.AddField(
+            model_name='feedentry',
+            name='recipe',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='feed_entries', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+        migrations.AddIndex(
+            model_name='feedentry',
+            index=models.Index(fields=['follower', '-pub_date', '-recipe'], name='feed_follower_pub_date_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='feedentry',
+            constraint=models.UniqueConstraint(fields=('follower', 'recipe'), name='unique_follower_recipe_feed'),
+        ),
+        migrations.RunPython(fill_feed, migrations.RunPython.noop),
+    ]
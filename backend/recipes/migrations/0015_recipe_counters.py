@@ -0,0 +1,54 @@
+# Generated by Django 3.2.3 on 2026-10-18 20:56
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count_related(model, field):
+    return Coalesce(Subquery(
+        model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            count=Count('pk')
+        ).values('count')
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorites = apps.get_model('recipes', 'Favorites')
+    ShoppingList = apps.get_model('recipes', 'ShoppingList')
+    User = apps.get_model('users', 'User')
+    Follow = apps.get_model('users', 'Follow')
+
+    Recipe.objects.update(
+        favorites_count=count_related(Favorites, 'recipe'),
+        shopping_carts_count=count_related(ShoppingList, 'recipe'),
+    )
+    User.objects.update(
+        recipes_count=count_related(Recipe, 'author'),
+        followers_count=count_related(Follow, 'author'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0014_feedentry'),
+        ('users', '0004_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_carts_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='В списках покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
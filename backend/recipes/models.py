@@ -1,9 +1,42 @@
 from colorfield.fields import ColorField
+from django.contrib.postgres.indexes import GinIndex
+from django.core.exceptions import ValidationError
 from django.core.validators import RegexValidator, MinValueValidator
 from django.db import models
+from django.db.models import Case, Value, When
+
+from recipes.storage import ContentHashStorage
 from users.models import User
 
 
+def normalize_name(value):
+    """Приведение названия к виду для поиска и проверки уникальности."""
+
+    return ' '.join(value.lower().replace('ё', 'е').split())
+
+
+class IngredientsQuerySet(models.QuerySet):
+    """Queryset ингредиентов с поиском по нормализованному названию."""
+
+    def search(self, query):
+        """
+        Поиск по вхождению в название одним запросом (индекс
+        триграмм): сначала совпадения по началу названия, затем
+        остальные.
+        """
+
+        query = normalize_name(query)
+        return self.filter(
+            normalized_name__contains=query
+        ).annotate(
+            is_prefix=Case(
+                When(normalized_name__startswith=query, then=Value(True)),
+                default=Value(False),
+                output_field=models.BooleanField(),
+            )
+        ).order_by('-is_prefix', 'normalized_name')
+
+
 class Ingredients(models.Model):
     """Модель для ингредиентов."""
 
@@ -12,19 +45,62 @@ class Ingredients(models.Model):
         verbose_name='Название ингредиента',
         help_text='Введите название ингредиента'
     )
+    normalized_name = models.CharField(
+        max_length=150,
+        editable=False,
+        verbose_name='Нормализованное название',
+    )
     measurement_unit = models.CharField(
         max_length=50,
         verbose_name='Единица измерения',
         help_text='Введите единицу измерения'
     )
 
+    objects = IngredientsQuerySet.as_manager()
+
     class Meta:
         verbose_name = 'Ингредиент'
         verbose_name_plural = 'Ингредиенты'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('normalized_name', 'measurement_unit'),
+                name='unique_ingredient_name_unit',
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('normalized_name',),
+                name='ingredient_name_pattern_idx',
+                opclasses=('text_pattern_ops',),
+            ),
+            GinIndex(
+                fields=('normalized_name',),
+                name='ingredient_name_trgm_idx',
+                opclasses=('gin_trgm_ops',),
+            ),
+        )
 
     def __str__(self):
         return f'{self.name}'
 
+    def clean(self):
+        """Проверка на дубликат с точностью до регистра и пробелов."""
+
+        duplicates = Ingredients.objects.filter(
+            normalized_name=normalize_name(self.name),
+            measurement_unit=self.measurement_unit,
+        ).exclude(pk=self.pk)
+
+        if duplicates.exists():
+            raise ValidationError(
+                f'Ингредиент "{self.name}" ({self.measurement_unit}) '
+                f'уже существует'
+            )
+
+    def save(self, *args, **kwargs):
+        self.normalized_name = normalize_name(self.name)
+        super().save(*args, **kwargs)
+
 
 class Tags(models.Model):
     """Модель для тэгов."""
@@ -90,9 +166,17 @@ class Recipe(models.Model):
         default=None,
         null=True,
         upload_to='recipes/images/',
+        storage=ContentHashStorage(),
         verbose_name='Изображение',
         help_text='Загрузите изображение'
     )
+    image_variants = models.JSONField(
+        default=dict,
+        blank=True,
+        editable=False,
+        verbose_name='Уменьшенные копии изображения',
+        help_text='Пути к копиям изображения по размерам и форматам'
+    )
     name = models.TextField(
         max_length=200,
         blank=False,
@@ -122,6 +206,27 @@ class Recipe(models.Model):
         auto_now_add=True,
         verbose_name='Время публикации'
     )
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Время изменения'
+    )
+    favorites_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В избранном',
+    )
+    shopping_carts_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='В списках покупок',
+    )
+    fanned_out = models.BooleanField(
+        default=True,
+        editable=False,
+        verbose_name='Разослан по лентам подписчиков',
+        help_text='Нет — рецепт популярного автора, лента читает его '
+                  'из таблицы рецептов'
+    )
     favorited_by = models.ManyToManyField(
         User,
         through='Favorites',
@@ -141,10 +246,35 @@ class Recipe(models.Model):
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = (
+            models.Index(
+                fields=('id',),
+                condition=models.Q(image_variants={}),
+                name='recipe_pending_variants_idx'
+            ),
+            models.Index(
+                fields=('-pub_date', '-id'),
+                condition=models.Q(fanned_out=False),
+                name='recipe_feed_pull_idx'
+            ),
+        )
 
     def __str__(self):
         return f'{self.name}'
 
+    def save(self, *args, **kwargs):
+        """
+        При загрузке нового изображения старые копии сбрасываются,
+        и рецепт попадает в очередь воркера изображений.
+        """
+
+        if self.image and not self.image._committed:
+            self.image_variants = {}
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = {*update_fields, 'image_variants'}
+        super().save(*args, **kwargs)
+
 
 class RecipeIngredient(models.Model):
     """Модель для связи рецептов и ингредиентов."""
@@ -256,3 +386,156 @@ class ShoppingList(models.Model):
 
     def __str__(self):
         return f'{self.user} добавил "{self.recipe}" в список покупок'
+
+
+class FeedEntry(models.Model):
+    """
+    Строка ленты подписчика: рецепт автора, на которого он подписан.
+    Записывается при публикации рецепта и при подписке.
+    """
+
+    follower = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Подписчик',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+        verbose_name='Рецепт',
+    )
+    author = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='+',
+        verbose_name='Автор',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Время публикации',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('follower', 'recipe'),
+                name='unique_follower_recipe_feed'
+            ),
+        )
+        indexes = (
+            models.Index(
+                fields=('follower', '-pub_date', '-recipe'),
+                name='feed_follower_pub_date_idx'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.follower}: {self.recipe}'
+
+
+class ShoppingCartTotal(models.Model):
+    """
+    Суммарное количество ингредиента в списке покупок пользователя.
+    Поддерживается инкрементально при изменении списка покупок
+    и ингредиентов рецептов из него.
+    """
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_totals',
+        verbose_name='Пользователь',
+    )
+    ingredient = models.ForeignKey(
+        Ingredients,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_totals',
+        verbose_name='Ингредиент',
+    )
+    amount = models.IntegerField(
+        verbose_name='Количество',
+    )
+
+    class Meta:
+        verbose_name = 'Итог списка покупок'
+        verbose_name_plural = 'Итоги списков покупок'
+        constraints = (
+            models.UniqueConstraint(
+                fields=('user', 'ingredient'),
+                name='unique_user_ingredient_cart_total'
+            ),
+        )
+
+    def __str__(self):
+        return f'{self.user}: {self.ingredient} - {self.amount}'
+
+
+class ShoppingCartExport(models.Model):
+    """
+    Задание на формирование pdf со списком покупок.
+    Очередь хранится в БД и разбирается командой run_export_worker.
+    """
+
+    PENDING = 'pending'
+    PROCESSING = 'processing'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [
+        (PENDING, 'В очереди'),
+        (PROCESSING, 'Формируется'),
+        (DONE, 'Готово'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='shopping_cart_exports',
+        verbose_name='Пользователь',
+    )
+    status = models.CharField(
+        choices=STATUS_CHOICES,
+        default=PENDING,
+        max_length=20,
+        verbose_name='Статус',
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Время создания'
+    )
+    started_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Время начала обработки'
+    )
+    finished_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Время завершения'
+    )
+    pdf = models.BinaryField(
+        null=True,
+        editable=False,
+        verbose_name='Файл pdf'
+    )
+    error = models.TextField(
+        blank=True,
+        verbose_name='Ошибка'
+    )
+
+    class Meta:
+        verbose_name = 'Выгрузка списка покупок'
+        verbose_name_plural = 'Выгрузки списков покупок'
+        indexes = (
+            models.Index(
+                fields=('status', 'id'),
+                name='shopping_cart_export_queue_idx',
+            ),
+        )
+        ordering = ('-id',)
+
+    def __str__(self):
+        return f'Выгрузка списка покупок {self.user} ({self.status})'
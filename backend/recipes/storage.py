@@ -0,0 +1,54 @@
+import posixpath
+from hashlib import sha256
+
+from django.core.files.storage import FileSystemStorage
+from django.db import connection
+from django.utils.deconstruct import deconstructible
+
+
+def lock_stored_file(name):
+    """
+    Транзакционная advisory-блокировка PostgreSQL по имени файла
+    (до конца текущей транзакции). Ею сериализуются запись файла с
+    таким же содержимым и удаление файла, на который не осталось ссылок.
+    """
+
+    key = int(sha256(name.encode()).hexdigest()[:15], 16)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_xact_lock(%s)', (key,))
+
+
+@deconstructible
+class ContentHashStorage(FileSystemStorage):
+    """
+    Хранилище с адресацией по содержимому: файл сохраняется под именем
+    <каталог>/<первые 2 символа хэша>/<sha256>.<расширение>.
+    Если такой файл уже есть, повторная запись пропускается, и
+    несколько записей ссылаются на один файл.
+    Сохранять нужно в транзакции, в которой создаётся ссылка на файл:
+    блокировка имени держится до коммита, и удаление файла
+    (release_recipe_image) до этого момента ждёт.
+    """
+
+    def save(self, name, content, max_length=None):
+        if name is None:
+            name = content.name
+
+        digest = sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        content.seek(0)
+
+        directory = posixpath.dirname(name)
+        extension = posixpath.splitext(name)[1].lower()
+        content_hash = digest.hexdigest()
+        name = posixpath.join(
+            directory, content_hash[:2], f'{content_hash}{extension}'
+        )
+
+        lock_stored_file(name)
+        if self.exists(name):
+            return name
+        # При гонке с параллельной записью того же файла _save сам
+        # подберёт свободное имя через get_available_name.
+        return self._save(name, content)
@@ -1,12 +1,31 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin
 
+from recipes.admin_utils import AuthorFilter, InputFilter
 from users.models import User, Follow
 
 admin.site.site_title = 'Foodgram'
 admin.site.site_header = 'Проект "Foodgram"'
 
 
+class FollowerFilter(InputFilter):
+    parameter_name = 'follower'
+    title = 'подписчику'
+    lookup = 'follower__username'
+
+
+class UsernameFilter(InputFilter):
+    parameter_name = 'username'
+    title = 'username'
+    lookup = 'username'
+
+
+class EmailFilter(InputFilter):
+    parameter_name = 'email'
+    title = 'email'
+    lookup = 'email'
+
+
 @admin.register(User)
 class UserAdmin(UserAdmin):
     """Приложение users."""
@@ -16,7 +35,7 @@ class UserAdmin(UserAdmin):
     )
     list_display_links = ('username', 'email')
     search_fields = ('username', 'email')
-    list_filter = ('username', 'email')
+    list_filter = (UsernameFilter, EmailFilter, 'role', 'is_active')
     ordering = ('id',)
     empty_value_display = '-Пусто-'
 
@@ -27,5 +46,8 @@ class FollowAdmin(admin.ModelAdmin):
 
     list_display = ('author', 'follower')
     list_display_links = ('author', 'follower')
-    list_filter = ('author', 'follower')
+    list_select_related = ('author', 'follower')
+    autocomplete_fields = ('author', 'follower')
+    search_fields = ('author__username', 'follower__username')
+    list_filter = (AuthorFilter, FollowerFilter)
     ordering = ('author',)
@@ -1,6 +1,29 @@
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
 from django.core.validators import RegexValidator
 from django.db import models
+from django.db.models import Exists, OuterRef, Value
+
+
+class UserQuerySet(models.QuerySet):
+    """Queryset пользователей с аннотациями для API."""
+
+    def with_is_subscribed(self, user):
+        """
+        Аннотирует каждого пользователя признаком подписки на него
+        пользователя user одним подзапросом EXISTS.
+        """
+
+        if user is None or not user.is_authenticated:
+            return self.annotate(is_subscribed=Value(False))
+        return self.annotate(
+            is_subscribed=Exists(Follow.objects.filter(
+                follower=user, author_id=OuterRef('pk')
+            ))
+        )
+
+
+class CustomUserManager(UserManager.from_queryset(UserQuerySet)):
+    """Менеджер пользователей с методами UserQuerySet."""
 
 
 class User(AbstractUser):
@@ -58,6 +81,16 @@ class User(AbstractUser):
         verbose_name='Роль',
         help_text='Выберите роль'
     )
+    recipes_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество рецептов',
+    )
+    followers_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Количество подписчиков',
+    )
 
     class Meta:
         verbose_name = 'Пользователь'
@@ -70,6 +103,8 @@ class User(AbstractUser):
         )
         ordering = ('id',)
 
+    objects = CustomUserManager()
+
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = ('username', 'first_name', 'last_name', 'password')
 